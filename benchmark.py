@@ -0,0 +1,161 @@
+#!/usr/bin/pypy -O
+"""Throughput benchmarks for the rollsum classes and maps."""
+import json
+import random
+import time
+from copy import copy
+from itertools import izip
+import rollsum
+
+K = 1024
+
+def besttime(setup, run, repeat=3):
+  """Get the best time of repeat calls of run(setup())."""
+  best = None
+  for i in xrange(repeat):
+    arg = setup()
+    t = time.time()
+    run(arg)
+    t = time.time() - t
+    if best is None or t < best:
+      best = t
+  return max(best, 1e-9)
+
+def bench_update(sum, data, repeat=3):
+  """Get the bytes/s of update() with all of data."""
+  def run(rs):
+    rs.update(data)
+  return len(data) / besttime(lambda: copy(sum), run, repeat)
+
+def bench_rollin(sum, data, repeat=3):
+  """Get the bytes/s of rollin() for every byte of data."""
+  def run(rs):
+    rollin = rs.rollin
+    for c in data:
+      rollin(c)
+  return len(data) / besttime(lambda: copy(sum), run, repeat)
+
+def bench_rollout(sum, data, repeat=3):
+  """Get the bytes/s of rollout() for every byte of data after update()."""
+  def setup():
+    rs = copy(sum)
+    rs.update(data)
+    return rs
+  def run(rs):
+    rollout = rs.rollout
+    for c in data:
+      rollout(c)
+  return len(data) / besttime(setup, run, repeat)
+
+def bench_digest(sum, data, repeat=3):
+  """Get the digest() calls/s, which is the bytes/s for rolling digests."""
+  def run(rs):
+    digest = rs.digest
+    for i in xrange(len(data)):
+      digest()
+  return len(data) / besttime(lambda: copy(sum), run, repeat)
+
+def bench_rotate(sum, data, blocksize, repeat=3):
+  """Get the bytes/s of rotate() through data with a blocksize window."""
+  def setup():
+    rs = copy(sum)
+    rs.update(data[:blocksize])
+    return rs
+  def run(rs):
+    rotate = rs.rotate
+    for c1, cn in izip(data, data[blocksize:]):
+      rotate(c1, cn)
+  return (len(data) - blocksize) / besttime(setup, run, repeat)
+
+def bench_rotates(sum, data, blocksize, repeat=3):
+  """Get the bytes/s of rotates() through data with a blocksize window."""
+  def setup():
+    rs = copy(sum)
+    rs.update(data[:blocksize])
+    return rs
+  def run(rs):
+    rs.rotates(data, blocksize)
+  return (len(data) - blocksize) / besttime(setup, run, repeat)
+
+def dobench(sum, data, blocksizes, repeat=3):
+  """Benchmark all the methods of a rollsum returning a {test: bytes/s} dict.
+
+  The tests are named "<rollsum> <method>", with " B=<blocksize>" appended
+  for the methods that depend on the blocksize.
+  """
+  results = {}
+  for name, bench in (('update', bench_update), ('rollin', bench_rollin),
+                      ('rollout', bench_rollout), ('digest', bench_digest)):
+    results['%s %s' % (sum, name)] = bench(sum, data, repeat)
+  for blocksize in blocksizes:
+    for name, bench in (('rotate', bench_rotate), ('rotates', bench_rotates)):
+      key = '%s %s B=%s' % (sum, name, blocksize)
+      results[key] = bench(sum, data, blocksize, repeat)
+  return results
+
+def compare(results, baseline):
+  """Get the sorted (test, speed, ratio) results compared to a baseline.
+
+  The ratio is speed over the baseline speed, or None for tests not in the
+  baseline.
+  """
+  ans = []
+  for key, speed in sorted(results.iteritems()):
+    old = baseline.get(key)
+    ans.append((key, speed, speed / old if old else None))
+  return ans
+
+def printtable(results, tolerance=0.1):
+  f = '='
+  hdr = '%-68s %10s %7s %4s'
+  fmt = '%-68s %10.3f %7s %4s'
+  frame = hdr % (68*f, 10*f, 7*f, 4*f)
+  print frame
+  print hdr % ('test', 'MB/s', 'ratio', '')
+  print frame
+  for key, speed, ratio in results:
+    flag = 'SLOW' if ratio is not None and ratio < 1 - tolerance else ''
+    ratio = '%7.3f' % ratio if ratio is not None else '-'
+    print fmt % (key, speed / 2**20, ratio, flag)
+  print frame
+
+
+if __name__ == "__main__":
+
+  import sys,argparse
+
+  parser = argparse.ArgumentParser(description='Benchmark the speed of different rollsum variants')
+  parser.add_argument('--rollsum','-R', nargs='+', choices=sorted(rollsum.classes), default=sorted(rollsum.classes), help='Rollsums to benchmark.')
+  parser.add_argument('--map', nargs='+', choices=sorted(rollsum.maps), default=sorted(rollsum.maps), help='Maps to benchmark.')
+  parser.add_argument('--blocksize','-B', nargs='+', type=rollsum.sizearg, default=[16, 1*K, 64*K], help='Block sizes to benchmark rotates with.')
+  parser.add_argument('--size', type=rollsum.sizearg, default=256*K, help='Number of bytes of data to benchmark with.')
+  parser.add_argument('--input', type=argparse.FileType('rb'), help='File to read data from instead of using random data.')
+  parser.add_argument('--repeat', type=int, default=3, help='Number of times to repeat each test, using the best time.')
+  parser.add_argument('--json', help='File to save the results to as JSON.')
+  parser.add_argument('--baseline', type=argparse.FileType('r'), help='JSON file of saved results to compare against.')
+  parser.add_argument('--tolerance', type=float, default=0.1, help='Fraction slower than the baseline to flag as a regression.')
+  args=parser.parse_args()
+
+  if args.input:
+    data = args.input.read(args.size)
+  else:
+    rnd = random.Random(1)
+    data = ''.join(chr(rnd.getrandbits(8)) for i in xrange(args.size))
+  blocksizes = [b for b in args.blocksize if b < len(data)]
+  results = {}
+  for r in args.rollsum:
+    for m in args.map:
+      sum = rollsum.classes[r](map=rollsum.maps[m])
+      results.update(dobench(sum, data, blocksizes, args.repeat))
+  baseline = json.load(args.baseline)['results'] if args.baseline else {}
+  ans = compare(results, baseline)
+  print "Results for size=%s repeat=%s" % (len(data), args.repeat)
+  print
+  printtable(ans, args.tolerance)
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(dict(size=len(data), repeat=args.repeat, results=results), f,
+                indent=2, sort_keys=True)
+  # Exit with an error if there were any regressions.
+  if any(r is not None and r < 1 - args.tolerance for _, _, r in ans):
+    sys.exit(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/pypy -O
+"""Content defined chunking using rolling checksums."""
+from copy import copy
+from math import log
+import time
+import rollsum
+
+K = 1024
+
+def findcut(sums, mask, mult=1, shift=0):
+  """Find the index of the first digest in sums with all mask bits zero.
+
+  The digests are mixed with (d ^ d >> shift) * mult first, so with an odd
+  mult and a mask of the highest bits every bit tested depends on all the
+  digest bits.
+  """
+  for i, d in enumerate(sums):
+    if not ((d ^ d >> shift) * mult) & mask:
+      return i
+  return -1
+
+def chunk(stream, sum, min_size=2*K, avg_size=8*K, max_size=64*K, window=32,
+          readsize=2**20, step=4*K):
+  """Generate content defined (offset, size) chunks from stream.
+
+  A chunk boundary is put after the first window of the rollsum "sum" past
+  min_size with the highest bits of its digest times a large odd constant all
+  zero, or at max_size. The number of bits tested is chosen so chunks average
+  about avg_size. The multiply spreads all the digest bits into the bits
+  tested, because the low bits of Gear and the high bits of RGear only depend
+  on the last few bytes. The rollsum is not hashed over the first min_size bytes of
+  each chunk, and is rolled through the rest step bytes at a time using
+  rotates().
+
+  The sum argument is used as a template that is copied for every chunk. For
+  the Gear variants the window should be the 32 bytes they always hash.
+  """
+  bits = int(round(log(max(1, avg_size - min_size), 2)))
+  mask = ((1 << bits) - 1) << (sum.width - bits)
+  mult = 0x9e3779b97f4a7c15 if sum.width == 64 else 0x9e3779b1
+  shift = sum.width // 2
+  min_size = max(1, min_size)
+  buf, base, offset = '', 0, 0
+  eof = False
+  while True:
+    # Make sure buf has data from a window before offset upto max_size.
+    while not eof and base + len(buf) < offset + max_size:
+      data = stream.read(readsize)
+      if data:
+        skip = max(0, offset - window - base)
+        buf, base = buf[skip:] + data, base + skip
+      else:
+        eof = True
+    end = min(offset + max_size, base + len(buf))
+    if end <= offset:
+      return
+    cut = end
+    # Roll from a window before min_size, stopping at the first cut point.
+    start = max(0, offset + min_size - window)
+    if start + window <= end:
+      rs = copy(sum)
+      pos, stop = start + window, min(start + window + step, end)
+      sums = rs.digests(buffer(buf, start - base, stop - start), window)
+      i = findcut(sums, mask, mult, shift)
+      while i < 0 and stop < end:
+        pos, stop = stop + 1, min(stop + step, end)
+        data = buffer(buf, pos - 1 - window - base, stop - pos + 1 + window)
+        sums = rs.rotates(data, window)
+        i = findcut(sums, mask, mult, shift)
+      if i >= 0:
+        cut = pos + i
+    yield offset, cut - offset
+    offset = cut
+
+def runchunks(stream, sum, min_size=2*K, avg_size=8*K, max_size=64*K,
+              window=32):
+  """Chunk a stream returning the chunk size Stats and the elapsed time."""
+  sizes = rollsum.Stats()
+  t = time.time()
+  for offset, size in chunk(stream, sum, min_size, avg_size, max_size, window):
+    sizes.add(size)
+  return sizes, time.time() - t
+
+
+if __name__ == "__main__":
+
+  import sys,argparse
+
+  parser = argparse.ArgumentParser(description='Test content defined chunking with different rollsums')
+  parser.add_argument('--rollsum','-R', choices=('cp', 'gr', 'rg', 'mg', 'ug'), default='gr', help='Rollsum to use.')
+  parser.add_argument('--map', type=rollsum.maparg, default=rollsum.mix, help='Map type to use "ord|pow|mul|mix|lcg|ipfs" or a map table file.')
+  parser.add_argument('--offs', type=int, default=0, help='Value to add to each input byte.')
+  parser.add_argument('--window','-W', type=rollsum.sizearg, default=32, help='Rolling window size to use.')
+  parser.add_argument('--min', type=rollsum.sizearg, default=2*K, help='Minimum chunk size.')
+  parser.add_argument('--avg', type=rollsum.sizearg, default=8*K, help='Target average chunk size.')
+  parser.add_argument('--max', type=rollsum.sizearg, default=64*K, help='Maximum chunk size.')
+  args=parser.parse_args()
+
+  sum = rollsum.classes[args.rollsum](offs=args.offs, map=args.map)
+  sizes, t = runchunks(sys.stdin, sum, args.min, args.avg, args.max, args.window)
+  print "Results for min=%s avg=%s max=%s window=%s %s" % (
+      args.min, args.avg, args.max, args.window, sum)
+  print
+  print "chunks: %s" % sizes
+  print "speed: time=%.3fs chunks/s=%.1f MB/s=%.3f" % (
+      t, sizes.num / t, sizes.sum / t / 2**20)
@@ -1,22 +1,36 @@
 #!/usr/bin/pypy -O
+import hashlib
+import mmap
+import shelve
+from multiprocessing import cpu_count
+import corpus
 import rollsum
 
 bc = 1000000
 K = 1024
 
 def dotest(src, bsize, bcount, sum):
-  f = open('data/%s.dat' % src, 'rb')
-  table = rollsum.HashTable(2**32, lambda k: k)
-  clust = rollsum.HashTable(2**16, lambda k: (k & (2**20 - 1)) >> 4)
-  datastats = rollsum.runtest(sum, f, bsize, bcount, (table, clust))
-  #print "%-52s: %s %s" % (sum, table, clust)
-  colls = table.stats()
-  clust  = clust.stats()
-  collsw, clustw = colls.weight, clust.weight
-  # Score is geometric mean of collision and cluster performance,
-  # Weighted by their digits of accuracy.
-  score = (colls.perf**collsw * clust.perf**clustw)**(1/(collsw + clustw))
-  return src, bsize, bcount, sum, colls, clust, score
+  return dotests(src, bcount, [(bsize, sum)])[0]
+
+def dotests(src, bcount, tests):
+  """Run dotest() for a list of (bsize, sum) tests in one pass of the data."""
+  data = opendata(src)
+  tables = [(rollsum.HashTable(2**32, lambda k: k),
+             rollsum.HashTable(2**16, lambda k: (k & (2**20 - 1)) >> 4))
+            for bsize, sum in tests]
+  rollsum.runtests([(sum, bsize, t) for (bsize, sum), t in zip(tests, tables)],
+                   data, bcount)
+  results = []
+  for (bsize, sum), (table, clust) in zip(tests, tables):
+    #print "%-52s: %s %s" % (sum, table, clust)
+    colls = table.stats()
+    clust  = clust.stats()
+    collsw, clustw = colls.weight, clust.weight
+    # Score is geometric mean of collision and cluster performance,
+    # Weighted by their digits of accuracy.
+    score = (colls.perf**collsw * clust.perf**clustw)**(1/(collsw + clustw))
+    results.append((src, bsize, bcount, sum, colls, clust, score))
+  return results
 
 def fmtstats(stats):
   return '%s/%s/%8.6f/%8.6f' % (stats.min, stats.max, stats.colls, stats.perf)
@@ -38,46 +52,137 @@ def printtable(results):
     print fmt % (src, bsize, bcount, sum, table, clust, score)
   print frame
 
+def rollsums(blocksize):
+  """Generate all the rollsum variants to test for a blocksize."""
+  # test Gear variants with blocksize<=32 only.
+  if blocksize <= 32:
+    # Test Gear variants with different mappings.
+    for mapfunc in (ord, rollsum.mul, rollsum.mix, rollsum.ipfs):
+      yield rollsum.Gear(map=mapfunc)
+      yield rollsum.RGear(map=mapfunc)
+      yield rollsum.UGear(map=mapfunc)
+    # Test MGear with ord mapping only.
+    yield rollsum.MGear(map=ord)
+  # Test rsync rollsum seed and offs values.
+  yield rollsum.RollSum(seed=0, offs=31, base=0x10000, map=ord)
+  # Test RabinKarp with seed and offs.
+  yield rollsum.RabinKarp(seed=1, mult=0x08104225, map=ord)
+  yield rollsum.RabinKarp(offs=1, mult=0x08104225, map=ord)
+  # Test CyclicPoly with different mappings.
+  for mapfunc in (ord, rollsum.pow, rollsum.mul, rollsum.mix, rollsum.ipfs):
+    yield rollsum.CyclicPoly(map=mapfunc)
+  # Test RollSum and RabinKarp with different mappings.
+  for mapfunc in (ord, rollsum.pow, rollsum.mul):
+    yield rollsum.RollSum(seed=1, offs=0, base=0x10000, map=mapfunc)
+    for mult in (0xfffffffd, 0x55555555, 0x08104225, 0x41c64e6d):
+      yield rollsum.RabinKarp(mult=mult, map=mapfunc)
+
+# The prefix for synthetic corpus data sources, so "synth:csv" is a generated
+# Corpus('csv') and "csv" is always the data/csv.dat file.
+synth = 'synth:'
+
+def synthkind(src):
+  """Get the corpus kind for a "synth:<kind>" data source, or None."""
+  if src.startswith(synth):
+    kind = src[len(synth):]
+    if kind not in corpus.kinds:
+      raise ValueError(src)
+    return kind
+  return None
+
+def opendata(src):
+  """Get an mmap of a data file, or a Corpus for synthetic data sources."""
+  kind = synthkind(src)
+  if kind:
+    return corpus.Corpus(kind)
+  with open('data/%s.dat' % src, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def datahash(src):
+  """Get the sha1 hexdigest of a data file's contents.
+
+  Synthetic data is identified by its kind and seed instead.
+  """
+  kind = synthkind(src)
+  if kind:
+    return str(corpus.Corpus(kind))
+  h = hashlib.sha1()
+  with open('data/%s.dat' % src, 'rb') as f:
+    for block in iter(lambda: f.read(2**20), ''):
+      h.update(block)
+  return h.hexdigest()
+
+def cellkey(dhash, bsize, bcount, sum):
+  """Get the results store key for a test cell."""
+  return repr((dhash, str(sum), bsize, bcount))
+
+def _rungroup(groups, i):
+  """Run the test cells in group i of groups in a single pass of the data.
+
+  Returns a list of the cell keys and picklable results.
+  """
+  (src, bcount), cells = groups[i]
+  keys, tests = zip(*cells)
+  results = dotests(src, bcount, tests)
+  return [(key, (src, bsize, bcount, str(sum), colls, clust, score))
+          for key, (src, bsize, bcount, sum, colls, clust, score)
+          in zip(keys, results)]
+
+def runcells(cells, store, jobs):
+  """Run all the (key, args) dotest cells not already in store.
+
+  Cells with the same data and blockcount are run together in a single pass
+  of the data, split into at least jobs groups of blocksizes so all the
+  workers are used. Results are saved in the store as each group completes,
+  so interrupted or extended runs only need to compute the new cells.
+  """
+  groups = {}
+  for key, (src, bsize, bcount, sum) in cells:
+    if key not in store:
+      groups.setdefault((src, bcount), []).append((key, (bsize, sum)))
+  # Split groups into contiguous runs of blocksizes to use all the workers.
+  nsplit = -(-jobs // max(1, len(groups)))
+  splits = []
+  for k, v in sorted(groups.items()):
+    v.sort(key=lambda c: c[1][0])
+    n = -(-len(v) // nsplit)
+    splits.extend((k, v[i:i+n]) for i in xrange(0, len(v), n))
+  runs = rollsum.forkmap(_rungroup, splits, len(splits), jobs, ordered=False)
+  for n, results in enumerate(runs, 1):
+    for key, result in results:
+      store[key] = result
+    store.sync()
+    print "done %s/%s: %s %s tests" % (n, len(splits), results[0][1][0], len(results))
+
+if __name__ == "__main__":
+
+  import argparse
+
+  parser = argparse.ArgumentParser(description='Compare different rollsum variants')
+  parser.add_argument('--jobs', '-j', type=int, default=cpu_count(), help='Number of processes to use.')
+  parser.add_argument('--store', default='data/cmphash.db', help='File to store test results in.')
+  parser.add_argument('--data', nargs='+', default=['csv', 'zip'], help='Data files or synthetic "synth:%s" data to use.' % '|'.join(corpus.kinds))
+  parser.add_argument('--blockcount', '-C', type=int, default=bc, help='Number of blocks to use.')
+  args=parser.parse_args()
 
-datas = ('csv', 'zip')
-sizes = (16, 32, 1*K, 4*K, 16*K, 64*K) # 256*K)
-ans = []
-# Test for different sources.
-for src in datas:
-  # Test for different blocksize.
-  for blocksize in sizes:
-    # test Gear variants with blocksize<=32 only.
-    if blocksize <= 32:
-      # Test Gear variants with different mappings.
-      for mapfunc in (ord, rollsum.mul, rollsum.mix, rollsum.ipfs):
-        sum = rollsum.Gear(map=mapfunc)
-        ans.append(dotest(src, blocksize, bc, sum))
-        sum = rollsum.RGear(map=mapfunc)
-        ans.append(dotest(src, blocksize, bc, sum))
-        sum = rollsum.UGear(map=mapfunc)
-        ans.append(dotest(src, blocksize, bc, sum))
-      # Test MGear with ord mapping only.
-      sum = rollsum.MGear(map=ord)
-      ans.append(dotest(src, blocksize, bc, sum))
-    # Test rsync rollsum seed and offs values.
-    sum = rollsum.RollSum(seed=0, offs=31, base=0x10000, map=ord)
-    ans.append(dotest(src, blocksize, bc, sum))
-    # Test RabinKarp with seed and offs.
-    sum = rollsum.RabinKarp(seed=1, mult=0x08104225, map=ord)
-    ans.append(dotest(src, blocksize, bc, sum))
-    sum = rollsum.RabinKarp(offs=1, mult=0x08104225, map=ord)
-    ans.append(dotest(src, blocksize, bc, sum))
-    # Test CyclicPoly with different mappings.
-    for mapfunc in (ord, rollsum.pow, rollsum.mul, rollsum.mix, rollsum.ipfs):
-      sum = rollsum.CyclicPoly(map=mapfunc)
-      ans.append(dotest(src, blocksize, bc, sum))
-    # Test RollSum and RabinKarp with different mappings.
-    for mapfunc in (ord, rollsum.pow, rollsum.mul):
-      sum = rollsum.RollSum(seed=1, offs=0, base=0x10000, map=mapfunc)
-      ans.append(dotest(src, blocksize, bc, sum))
-      for mult in (0xfffffffd, 0x55555555, 0x08104225, 0x41c64e6d):
-	sum = rollsum.RabinKarp(mult=mult, map=mapfunc)
-        ans.append(dotest(src, blocksize, bc, sum))
-# Sort results by src, bsize, and then score.
-ans = sorted(ans, key=lambda a: (a[0:2], -a[-1]))
-printtable(ans)
+  datas = args.data
+  bc = args.blockcount
+  sizes = (16, 32, 1*K, 4*K, 16*K, 64*K) # 256*K)
+  cells = []
+  # Test for different sources.
+  for src in datas:
+    dhash = datahash(src)
+    # Test for different blocksize.
+    for blocksize in sizes:
+      for sum in rollsums(blocksize):
+        key = cellkey(dhash, blocksize, bc, sum)
+        cells.append((key, (src, blocksize, bc, sum)))
+  store = shelve.open(args.store)
+  try:
+    runcells(cells, store, args.jobs)
+    ans = [store[key] for key, _ in cells]
+  finally:
+    store.close()
+  # Sort results by src, bsize, and then score.
+  ans = sorted(ans, key=lambda a: (a[0:2], -a[-1]))
+  printtable(ans)
@@ -0,0 +1,159 @@
+#!/usr/bin/pypy -O
+"""Lazily generated deterministic synthetic data for scaling tests."""
+import random
+from binascii import unhexlify
+
+K = 1024
+M = 1024*K
+
+kinds = ('random', 'lowentropy', 'csv', 'runs', 'mutated')
+
+def randbytes(rnd, size):
+  """Get a str of size random bytes from a random.Random instance."""
+  return unhexlify('%0*x' % (2*size, rnd.getrandbits(8*size)))
+
+def gen_random(rnd, blocksize):
+  """Generate blocks of uniformly random bytes."""
+  while True:
+    yield randbytes(rnd, blocksize)
+
+# Maps random bytes to 8 letters with probabilities 1/2, 1/4, ... 1/128, 1/128
+# for about 2 bits of entropy per byte.
+_lowentropy_map = ''.join(
+    'abcdefgh'[8 - (len(bin(c)) - 2)] for c in xrange(256))
+
+def gen_lowentropy(rnd, blocksize):
+  """Generate blocks of low entropy bytes from a skewed small alphabet."""
+  while True:
+    yield randbytes(rnd, blocksize).translate(_lowentropy_map)
+
+_csv_names = ('alice', 'bob', 'carol', 'dave', 'eve', 'frank', 'grace',
+              'heidi', 'ivan', 'judy', 'mallory', 'oscar', 'peggy', 'trent')
+
+def gen_csv(rnd, blocksize):
+  """Generate blocks of ASCII CSV rows with incrementing ids."""
+  row = 0
+  while True:
+    lines, size = [], 0
+    while size < blocksize:
+      line = '%d,%s,%d.%02d,2019-%02d-%02d\n' % (
+          row, rnd.choice(_csv_names), rnd.randrange(100000),
+          rnd.randrange(100), rnd.randint(1, 12), rnd.randint(1, 28))
+      lines.append(line)
+      size += len(line)
+      row += 1
+    yield ''.join(lines)
+
+def gen_runs(rnd, blocksize, avg=512):
+  """Generate blocks of long runs of repeated random bytes."""
+  while True:
+    runs, size = [], 0
+    while size < blocksize:
+      n = int(rnd.expovariate(1.0 / avg)) + 1
+      runs.append(chr(rnd.getrandbits(8)) * n)
+      size += n
+    yield ''.join(runs)
+
+def edit(rnd, data, inserts=0, deletes=0, overwrites=0, size=64):
+  """Make a randomly edited copy of data.
+
+  The inserts, deletes, and overwrites arguments are the number of each kind
+  of edit at random offsets, and each edit is a random length averaging size
+  bytes. Edits that overlap the previous edit are skipped. Returns the edited
+  data and a list of the offsets in it of the end of each edit.
+  """
+  n = len(data)
+  edits = sorted((rnd.randrange(n), kind)
+                 for kind, count in (('i', inserts), ('d', deletes), ('o', overwrites))
+                 for i in xrange(count))
+  out, ends, pos, outlen = [], [], 0, 0
+  for offset, kind in edits:
+    # Skip edits that overlap the previous edit.
+    if offset < pos:
+      continue
+    out.append(data[pos:offset])
+    outlen += offset - pos
+    length = rnd.randint(1, 2*size - 1)
+    if kind == 'i':
+      out.append(randbytes(rnd, length))
+      outlen, pos = outlen + length, offset
+    elif kind == 'd':
+      pos = min(n, offset + length)
+    else:
+      length = min(length, n - offset)
+      out.append(randbytes(rnd, length))
+      outlen, pos = outlen + length, offset + length
+    ends.append(outlen)
+  out.append(data[pos:])
+  return ''.join(out), ends
+
+def gen_mutated(rnd, blocksize, copysize=64*K, edits=4, editsize=8):
+  """Generate blocks of repeated copies of data with a few edits each.
+
+  Each copy is the previous copy with a few random edits averaging editsize
+  bytes, like successive versions of a file.
+  """
+  copy = randbytes(rnd, copysize)
+  while True:
+    copies, size = [], 0
+    while size < blocksize:
+      kinds = [rnd.randrange(3) for i in xrange(edits)]
+      copy, _ = edit(rnd, copy, kinds.count(0), kinds.count(1), kinds.count(2),
+                     editsize)
+      copies.append(copy)
+      size += len(copy)
+    yield ''.join(copies)
+
+
+class Corpus(object):
+  """A lazily generated deterministic synthetic data stream.
+
+  This is a file-like object with a read() method that generates the data a
+  block at a time as needed, so large corpora are never fully in memory. The
+  data only depends on the kind and seed, not on the sizes read. If size is
+  None the data is unlimited.
+  """
+
+  def __init__(self, kind, size=None, seed=1, blocksize=M):
+    assert kind in kinds
+    self.kind, self.size, self.seed = kind, size, seed
+    self.blocks = globals()['gen_' + kind](random.Random(seed), blocksize)
+    # The current block and the offset in it of the next byte to read.
+    self.buf, self.off = '', 0
+    self.pos = 0
+
+  def read(self, size=-1):
+    if self.size is not None:
+      remaining = self.size - self.pos
+      size = remaining if size < 0 else min(size, remaining)
+    elif size < 0:
+      raise ValueError('Cannot read all of an unlimited corpus.')
+    parts, need = [], size
+    while need:
+      if self.off == len(self.buf):
+        self.buf, self.off = next(self.blocks), 0
+      part = self.buf[self.off:self.off + need]
+      parts.append(part)
+      self.off += len(part)
+      need -= len(part)
+    self.pos += size
+    return ''.join(parts)
+
+  def __str__(self):
+    return 'Corpus(kind=%s, size=%s, seed=%s)' % (self.kind, self.size, self.seed)
+
+
+if __name__ == "__main__":
+
+  import sys,argparse
+  import rollsum
+
+  parser = argparse.ArgumentParser(description='Write synthetic data to stdout')
+  parser.add_argument('kind', choices=kinds, help='Kind of data to generate.')
+  parser.add_argument('--size', '-S', type=rollsum.sizearg, default=M, help='Number of bytes to generate.')
+  parser.add_argument('--seed', type=int, default=1, help='Random seed to use.')
+  args=parser.parse_args()
+
+  corpus = Corpus(args.kind, args.size, args.seed)
+  for block in iter(lambda: corpus.read(M), ''):
+    sys.stdout.write(block)
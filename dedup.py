@@ -0,0 +1,106 @@
+#!/usr/bin/pypy -O
+"""Deduplication and resync benchmarks for chunking with rollsums."""
+import md5
+import random
+from bisect import bisect_left
+from cStringIO import StringIO
+import time
+import rollsum
+import chunker
+import corpus
+
+K = 1024
+
+def chunks(data, sum, min_size, avg_size, max_size, window):
+  """Get the list of (offset, size) chunks of data and the elapsed time."""
+  t = time.time()
+  ans = list(chunker.chunk(StringIO(data), sum, min_size, avg_size, max_size,
+                           window))
+  return ans, time.time() - t
+
+def dotest(data, edited, ends, sum, min_size=2*K, avg_size=8*K, max_size=64*K,
+           window=32):
+  """Test dedup of edited data against data using chunking with sum.
+
+  Returns the dedup ratio of edited bytes found in data's chunks, Stats of
+  the bytes after each edit before the next duplicate chunk, and the chunking
+  speed in MB/s.
+  """
+  args = sum, min_size, avg_size, max_size, window
+  chunks1, t1 = chunks(data, *args)
+  chunks2, t2 = chunks(edited, *args)
+  known = set(md5.new(buffer(data, o, l)).digest() for o, l in chunks1)
+  starts, dupsize = [], 0
+  for o, l in chunks2:
+    if md5.new(buffer(edited, o, l)).digest() in known:
+      starts.append(o)
+      dupsize += l
+  ratio = float(dupsize) / len(edited)
+  # Find how many bytes after each edit it takes to get a duplicate chunk.
+  resync = rollsum.Stats()
+  for e in ends:
+    i = bisect_left(starts, e)
+    if i < len(starts):
+      resync.add(starts[i] - e)
+  speed = (len(data) + len(edited)) / (t1 + t2) / 2**20
+  return ratio, resync, speed
+
+def rollsums():
+  """Generate all the (rollsum, window) variants to test."""
+  for mapfunc in (rollsum.mix, rollsum.ipfs):
+    yield rollsum.Gear(map=mapfunc), 32
+    yield rollsum.RGear(map=mapfunc), 32
+    yield rollsum.UGear(map=mapfunc), 32
+  yield rollsum.MGear(map=ord), 32
+  for mapfunc in (rollsum.mix, rollsum.ipfs):
+    yield rollsum.CyclicPoly(map=mapfunc), 48
+  yield rollsum.RabinKarp(seed=1, map=ord), 48
+  yield rollsum.RollSum(seed=0, offs=31, map=ord), 48
+
+def printtable(results):
+  f = '='
+  hdr = '%3s %-52s %3s %8s %-24s %8s'
+  fmt = '%3s %-52s %3s %8.6f %-24s %8.3f'
+  frame = hdr % (3*f, 52*f, 3*f, 8*f, 24*f, 8*f)
+  print frame
+  print hdr % ('dat', 'rollsum', 'win', 'dedup', 'resync min/avg/max', 'MB/s')
+  print frame
+  for src, sum, window, ratio, resync, speed in results:
+    if resync.num:
+      resync = '%s/%.1f/%s' % (resync.min, resync.avg, resync.max)
+    else:
+      resync = 'never'
+    print fmt % (src, sum, window, ratio, resync, speed)
+  print frame
+
+
+if __name__ == "__main__":
+
+  import argparse
+
+  parser = argparse.ArgumentParser(description='Test dedup of edited data with different rollsums')
+  parser.add_argument('--inserts', type=float, default=1e-5, help='Insert edits per byte.')
+  parser.add_argument('--deletes', type=float, default=1e-5, help='Delete edits per byte.')
+  parser.add_argument('--overwrites', type=float, default=1e-5, help='Overwrite edits per byte.')
+  parser.add_argument('--editsize', type=rollsum.sizearg, default=64, help='Average edit size.')
+  parser.add_argument('--seed', type=int, default=1, help='Random seed for edits.')
+  parser.add_argument('--min', type=rollsum.sizearg, default=2*K, help='Minimum chunk size.')
+  parser.add_argument('--avg', type=rollsum.sizearg, default=8*K, help='Target average chunk size.')
+  parser.add_argument('--max', type=rollsum.sizearg, default=64*K, help='Maximum chunk size.')
+  args=parser.parse_args()
+
+  datas = ('csv', 'zip')
+  ans = []
+  for src in datas:
+    data = open('data/%s.dat' % src, 'rb').read()
+    n = len(data)
+    edited, ends = corpus.edit(random.Random(args.seed), data,
+                               int(args.inserts * n), int(args.deletes * n),
+                               int(args.overwrites * n), args.editsize)
+    for sum, window in rollsums():
+      ratio, resync, speed = dotest(data, edited, ends, sum, args.min,
+                                    args.avg, args.max, window)
+      ans.append((src, sum, window, ratio, resync, speed))
+  # Sort results by src and then dedup ratio.
+  ans = sorted(ans, key=lambda a: (a[0], -a[3]))
+  printtable(ans)
@@ -0,0 +1,176 @@
+#!/usr/bin/pypy -O
+"""An rsync style signature and delta engine using rollsums."""
+import md5
+from copy import copy
+from itertools import izip
+import time
+import rollsum
+
+K = 1024
+
+def signature(data, blocksize, sum):
+  """Get the list of (weak, strong) signatures for each block of data.
+
+  The weak sum is the digest of the rollsum "sum" from its block_digests(),
+  and the strong sum is the md5sum. Like rsync, a partial last block is
+  included.
+  """
+  weaks = sum.block_digests(data, blocksize)
+  return [(weak, md5.new(buffer(data, i, blocksize)).digest())
+          for i, weak in izip(xrange(0, len(data), blocksize), weaks)]
+
+
+class SigIndex(object):
+  """Hashtable index of block signatures for finding matching blocks.
+
+  This also counts the bucket entries probed, the strong sum checks done for
+  matching weak sums, and the strong sum checks that were false matches. The
+  tail is the size of the last block if it is partial, or 0.
+  """
+
+  def __init__(self, sigs, hashfunc, tail=0):
+    self.sigs, self.hash, self.tail = sigs, hashfunc, tail
+    self.data = dict()
+    for i, (weak, strong) in enumerate(sigs):
+      self.data.setdefault(hashfunc(weak), []).append(i)
+    self.probes = self.checks = self.false = 0
+
+  def find(self, weak, block):
+    """Find the index of a block matching the weak sum and data block."""
+    bucket = self.data.get(self.hash(weak))
+    if bucket:
+      self.probes += len(bucket)
+      strong = None
+      for i in bucket:
+        if self.sigs[i][0] == weak:
+          self.checks += 1
+          if strong is None:
+            strong = md5.new(block).digest()
+          if self.sigs[i][1] == strong:
+            return i
+          self.false += 1
+    return None
+
+
+def rolldigests(sum, data, pos, blocksize, step=16, maxstep=4*K):
+  """Generate (offset, digest) for every window of data from pos.
+
+  The rollsum "sum" is used as a template that is copied and updated with
+  the first window. It is then rolled through data using rotates() step
+  bytes at a time, doubling the step upto maxstep while the caller keeps
+  asking for more, so little work is wasted when it stops after a match.
+  """
+  if pos + blocksize > len(data):
+    return
+  rs = copy(sum)
+  rs.update(buffer(data, pos, blocksize))
+  yield pos, rs.digest()
+  stop = pos + blocksize
+  while stop < len(data):
+    last, stop = stop, min(len(data), stop + step)
+    for d in rs.rotates(buffer(data, last - blocksize, stop - last + blocksize),
+                        blocksize):
+      pos += 1
+      yield pos, d
+    step = min(maxstep, 2 * step)
+
+def delta(data, index, sum, blocksize, maxstep=4*K):
+  """Generate the ("match", block) and ("literal", str) ops to make data.
+
+  This rolls through data looking up each window's weak digest in the
+  signature index. After a match it skips to the window after the matched
+  block and restarts rolling. Like rsync, the end of data is also checked
+  against a partial last block.
+  """
+  pos = lit = 0
+  while True:
+    for off, weak in rolldigests(sum, data, pos, blocksize, maxstep=maxstep):
+      match = index.find(weak, buffer(data, off, blocksize))
+      if match is not None:
+        break
+    else:
+      break
+    if off > lit:
+      yield 'literal', data[lit:off]
+    yield 'match', match
+    pos = lit = off + blocksize
+  off = len(data) - index.tail
+  if index.tail and off >= lit:
+    weak = copy(sum)
+    weak.update(buffer(data, off))
+    match = index.find(weak.digest(), buffer(data, off))
+    if match is not None:
+      if off > lit:
+        yield 'literal', data[lit:off]
+      yield 'match', match
+      lit = len(data)
+  if lit < len(data):
+    yield 'literal', data[lit:]
+
+def patch(basis, ops, blocksize):
+  """Apply delta ops to basis data, returning the new data."""
+  out = []
+  for op, arg in ops:
+    if op == 'match':
+      out.append(basis[arg*blocksize:(arg+1)*blocksize])
+    else:
+      out.append(arg)
+  return ''.join(out)
+
+def dotest(basis, data, sum, blocksize, hashfunc):
+  """Do a signature and delta of data against basis.
+
+  Returns the ops, index, and the signature and delta times.
+  """
+  t = time.time()
+  index = SigIndex(signature(basis, blocksize, sum), hashfunc,
+                   len(basis) % blocksize)
+  t1 = time.time() - t
+  t = time.time()
+  ops = list(delta(data, index, sum, blocksize))
+  t2 = time.time() - t
+  return ops, index, t1, t2
+
+
+if __name__ == "__main__":
+
+  import argparse
+
+  parser = argparse.ArgumentParser(description='Test rsync style deltas with different rollsums')
+  parser.add_argument('basis', type=argparse.FileType('rb'), help='Basis file to make the signature from.')
+  parser.add_argument('new', type=argparse.FileType('rb'), help='New file to make the delta for.')
+  parser.add_argument('--rollsum','-R', choices=('rs', 'rk', 'cp'), default='rs', help='Rollsum to use.')
+  parser.add_argument('--blocksize','-B', type=rollsum.sizearg, default=1024, help='Block size to use.')
+  parser.add_argument('--seed', type=int, default=0, help='Value to initialize hash to.')
+  parser.add_argument('--offs', type=int, default=31, help='Value to add to each input byte.')
+  parser.add_argument('--base', type=eval, help='RollSum value to mod s1 and s2 with (default: 2^(width/2)).')
+  parser.add_argument('--mult', type=eval, help='RabinKarp multiplier to use (default: 0x08104225 or 0x5851f42d4c957f2d).')
+  parser.add_argument('--width', type=int, choices=(32, 64), default=32, help='Digest width in bits.')
+  parser.add_argument('--map', type=rollsum.maparg, default=ord, help='Map type to use "ord|pow|mul|mix|lcg|ipfs" or a map table file.')
+  parser.add_argument('--index', choices=('and', 'mod', 'mix'), default='mix', help='Hashtable index function to use.')
+  parser.add_argument('--indexbits', type=int, default=20, help='Number of bits in the hashtable index.')
+  args=parser.parse_args()
+
+  hashfunc = rollsum.indexfuncs(args.indexbits, args.width)[args.index]
+  kwargs = dict(seed=args.seed, offs=args.offs, map=args.map, width=args.width)
+  if args.rollsum == 'rs':
+    kwargs['base'] = args.base
+  elif args.rollsum == 'rk':
+    kwargs['mult'] = args.mult
+  sum = rollsum.classes[args.rollsum](**kwargs)
+  basis, data = args.basis.read(), args.new.read()
+  ops, index, t1, t2 = dotest(basis, data, sum, args.blocksize, hashfunc)
+  assert patch(basis, ops, args.blocksize) == data
+  matches = len([op for op, arg in ops if op == 'match'])
+  literal = len(''.join(arg for op, arg in ops if op == 'literal'))
+  print "Results for blocksize=%s %s index=%s_mask indexbits=%s" % (
+      args.blocksize, sum, args.index, args.indexbits)
+  print
+  print "signature: blocks=%s time=%.3fs MB/s=%.3f" % (
+      len(index.sigs), t1, len(basis) / t1 / 2**20)
+  print "delta: matches=%s literal=%s time=%.3fs MB/s=%.3f" % (
+      matches, literal, t2, len(data) / t2 / 2**20)
+  print "total: time=%.3fs MB/s=%.3f" % (t1 + t2, len(data) / (t1 + t2) / 2**20)
+  print "index: probes=%s checks=%s false=%s checks/byte=%.6f false/check=%.6f" % (
+      index.probes, index.checks, index.false, float(index.checks) / max(1, len(data)),
+      float(index.false) / max(1, index.checks))
@@ -1,12 +1,6 @@
 #!/usr/bin/pypy3
 import math
 import itertools
-from collections import deque
-
-def last(i):
-  """Get the last element of an iterator."""
-  v, = deque(i,1)
-  return v
 
 def modpow(k, n, m):
   """ Calculate "k^n" modular "m" efficiently.
@@ -25,6 +19,7 @@ def modpow(k, n, m):
     n >>= 1
   return ans
 
+_modinvs = {}
 def modinv(k, m):
   """ Calculate the inverse of "k" modular "m".
 
@@ -32,58 +27,154 @@ def modinv(k, m):
   equation;
 
   (i * k) % m = 1
+
+  The results are memoized since the same inverses are often needed again.
   """
-  # Values k and m need to be coprime AKA relatively prime.
-  assert not set(factors(m)) & set(factors(k))
+  i = _modinvs.get((k, m))
+  if i is not None:
+    return i
   x, xn = 0, 1
   n, d = m, k
   while d:
     q, r = n // d, n % d
     x, xn = xn, x - xn * q
     n, d = d, r
+  # Values k and m need to be coprime AKA relatively prime, so gcd(k,m)=1.
+  assert n == 1
   i = x % m
   # The inverse i multiplied by k modular m must give 1.
   assert (i * k) % m == 1
+  _modinvs[k, m] = i
   return i
 
+# The segment size for the segmented sieve.
+_segment = 1<<16
+
 _primes_searched = 2
 _primes = [2]
 def primes(m):
-  """Find all the primes less than or equal to m."""
+  """Find all the primes less than or equal to m.
+
+  The primes found are cached, and more are found as needed with a segmented
+  sieve that sieves one segment at a time with the cached primes.
+  """
   global _primes_searched
-  # Check next odd numbers upto and including m.
-  for x in range((_primes_searched+1)|1, m+1, 2):
-    if all(x % p for p in _primes):
-      _primes.append(x)
-  _primes_searched = max(_primes_searched, m)
+  while _primes_searched < m:
+    lo = _primes_searched + 1
+    # Segments can't go past the square of the primes already found.
+    hi = min(m, _primes_searched + _segment, _primes_searched**2)
+    _primes.extend(_sieve(lo, hi))
+    _primes_searched = hi
   return itertools.takewhile(lambda p: p<=m, _primes)
 
+def _sieve(lo, hi):
+  """Sieve the primes from lo to hi inclusive using the cached primes."""
+  sieve = bytearray([1]) * (hi - lo + 1)
+  for p in itertools.takewhile(lambda p: p*p <= hi, _primes):
+    # Start at the first multiple of p in the segment, but not p itself.
+    start = max(p*p, (lo + p - 1) // p * p)
+    sieve[start-lo::p] = bytearray(len(range(start-lo, len(sieve), p)))
+  return [lo + i for i, v in enumerate(sieve) if v]
+
+# The number of small primes for trial division before Pollard-rho.
+_small = 1<<10
+
+def isprime(n):
+  """Check if n is prime using trial division and Miller-Rabin.
+
+  The Miller-Rabin bases used are deterministic for n < 3.3*10^24.
+  """
+  if n < 2:
+    return False
+  for p in primes(_small):
+    if n % p == 0:
+      return n == p
+  if n < _small * _small:
+    return True
+  d, s = n - 1, 0
+  while not d & 1:
+    d, s = d >> 1, s + 1
+  for a in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41):
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+      continue
+    for r in range(s - 1):
+      x = x * x % n
+      if x == n - 1:
+        break
+    else:
+      return False
+  return True
+
+def rho(n):
+  """Find a non-trivial factor of composite n using Pollard-rho.
+
+  This uses Brent's cycle finding, and retries with a different c if it fails.
+  """
+  if not n & 1:
+    return 2
+  for c in itertools.count(1):
+    y, r, q, g = 2, 1, 1, 1
+    while g == 1:
+      x = y
+      for i in range(r):
+        y = (y*y + c) % n
+      k = 0
+      while k < r and g == 1:
+        ys = y
+        # Accumulate products to do fewer gcd's.
+        for i in range(min(128, r - k)):
+          y = (y*y + c) % n
+          q = q * abs(x - y) % n
+        g = math.gcd(q, n)
+        k += 128
+      r *= 2
+    if g == n:
+      # The batched gcd overshot, so backtrack one step at a time.
+      g = 1
+      while g == 1:
+        ys = (ys*ys + c) % n
+        g = math.gcd(abs(x - ys), n)
+    if g != n:
+      return g
+
 def maxprime(m):
-  return last(primes(m))
+  """Find the largest prime less than or equal to m."""
+  if m < 2:
+    raise ValueError('There are no primes <= %s.' % m)
+  while not isprime(m):
+    m -= 1
+  return m
 
 def factors(n):
-  """Find all the prime factors of n."""
+  """Find all the prime factors of n.
+
+  Small factors are found by trial division with the cached primes, and the
+  rest using Pollard-rho.
+  """
   f = []
-  fmax = math.isqrt(n)
-  # leverage off the primes cache.
-  if fmax <= _primes_searched:
-    fs = primes(fmax)
-  else:
-    fs = itertools.chain(_primes, range(_primes_searched+1, fmax+1, 2))
-  for i in fs:
-    while n % i == 0:
-      f.append(i)
-      n //= i
-  if n > 1:
-    f.append(n)
-  return f
+  for p in primes(_small):
+    while n % p == 0:
+      f.append(p)
+      n //= p
+  todo = [n] if n > 1 else []
+  while todo:
+    n = todo.pop()
+    if isprime(n):
+      f.append(n)
+    else:
+      d = rho(n)
+      todo.extend((d, n // d))
+  return sorted(f)
 
 def lcg_ac(m):
   """Calculate LCG a,c terms for a given m size."""
   factors_m = factors(m)
   primefactors_m = set(factors_m)
   # Choose the largest prime < m/2 that is not a factor of m.
-  c = max(set(primes(m//2)) - primefactors_m)
+  c = maxprime(m//2)
+  while c in primefactors_m:
+    c = maxprime(c - 1)
   # Make a-1 have all the prime factors of m.
   a_1 = math.prod(primefactors_m)
   # If m is divisible by 4, make sure a-1 is also.
@@ -1,12 +1,29 @@
 #!/usr/bin/pypy -O
+import cPickle
+import hashlib
 import md5
-from math import sqrt,log
-from lcg_inthash import modinv
+import mmap
+import operator
+import os
+import resource
+import time
+from array import array
+from binascii import hexlify, unhexlify
+from copy import copy
+from collections import Counter
+from heapq import heapify, heappop, heappush
+from itertools import imap, izip
+from multiprocessing import Pool
+from math import sqrt,log,ceil
+from lcg_inthash import modinv, modpow
 
 class BaseHash(object):
   """Base class for rolling checksums."""
 
-  def __init__(self, data=None, seed=0, offs=0, map=ord):
+  # The largest blocksize that block_digests() uses _columndigests() for.
+  _columnsize = 64
+
+  def __init__(self, data=None, seed=0, offs=0, map=ord, width=32):
     """Initialize a base rollsum calculator.
 
     Args:
@@ -14,9 +31,14 @@ class BaseHash(object):
       seed: initial hash value to use.
       offs: offset to add to each input byte.
       map: optional mapping function to transform input bytes.
+      width: optional digest width in bits, 32 or 64.
     """
+    assert width in (32, 64)
     self.seed, self.offs, self.map = seed, offs, map
-    self.mask = (1 << 32) - 1
+    self.width = width
+    self.mask = (1 << width) - 1
+    # The map(c) + offs value for every byte, indexed by ord(c).
+    self._cmap = self._table(offs)
     self.count, self.sum = 0, seed
     if data:
       self.update(data)
@@ -24,11 +46,83 @@ class BaseHash(object):
   def digest(self):
     return self.sum
 
+  def digests(self, data, blocksize):
+    """Get the digests of every blocksize window in data.
+
+    This updates with the first block and then rotates through the rest of the
+    data, giving the same digests and final state as doing it one byte at a
+    time with update(), rotate() and digest().
+    """
+    self.update(data[:blocksize])
+    return [self.digest()] + self.rotates(data, blocksize)
+
+  def rotates(self, data, blocksize):
+    """Rotate through data returning the digest after each rotate.
+
+    The rollsum must already contain data[:blocksize]. This is the reference
+    per-byte implementation, subclasses override it with faster whole-buffer
+    versions that must give identical results.
+    """
+    sums = []
+    for c1, cn in izip(data, data[blocksize:]):
+      self.rotate(c1, cn)
+      sums.append(self.digest())
+    return sums
+
+  def block_digests(self, data, blocksize):
+    """Get the digests of every blocksize block of data.
+
+    Each digest is for a copy of this rollsum updated with the block, like
+    for rsync signatures, and the last partial block is included if there is
+    one. This rollsum is not changed. Blocks upto _columnsize bytes are done
+    together a byte column at a time, which is faster than updating a copy
+    for each small block.
+    """
+    n = len(data) - len(data) % blocksize
+    if not n:
+      sums = []
+    elif blocksize <= self._columnsize:
+      sums = self._columndigests(buffer(data, 0, n), blocksize)
+    else:
+      sums = self._blockdigests(buffer(data, 0, n), blocksize)
+    if n < len(data):
+      sum = copy(self)
+      sum.update(buffer(data, n))
+      sums.append(sum.digest())
+    return sums
+
+  def _blockdigests(self, data, blocksize):
+    """Get the digests of the full blocks of data updating a copy for each."""
+    sums = []
+    for i in xrange(0, len(data), blocksize):
+      sum = copy(self)
+      sum.update(buffer(data, i, blocksize))
+      sums.append(sum.digest())
+    return sums
+
+  def _columndigests(self, data, blocksize):
+    """Get the digests of the full blocks of data a byte column at a time.
+
+    Subclasses override this with versions that update all the blocks
+    together with map() for each column of the k'th byte of every block,
+    which must give identical results to _blockdigests().
+    """
+    return self._blockdigests(data, blocksize)
+
+  def _widthstr(self):
+    """Get the width argument for __str__, which is omitted for 32bits."""
+    return ', width=%s' % self.width if self.width != 32 else ''
+
+  def _table(self, offs=0):
+    """Get a list mapping byte values to map(c) + offs."""
+    return [self.map(chr(c)) + offs for c in xrange(256)]
+
 
 class RollSum(BaseHash):
   """Rsync rollsum rolling checksum."""
 
-  def __init__(self, data=None, seed=0, offs=31, map=ord, base=2**16):
+  def __init__(self, data=None, seed=0, offs=31, map=ord, base=None,
+               width=32):
     """Initialize a rollsum calculator.
 
     Args:
@@ -36,80 +130,145 @@ class RollSum(BaseHash):
       seed: optional value to initialize sum with.
       offs: optional offset to add to each byte.
       map: optional mapping function to transform input bytes.
-      base: optional base to mod sum and sum2 with.
+      base: optional base to mod sum and sum2 with (default: 2^(width/2)).
+      width: optional digest width in bits, 32 or 64.
     """
-    # We only use 16 LSB's of the map output, so wrap map if it is >16bit.
+    # The sum and sum2 are each half the digest width.
+    self._half = width // 2
+    hmask = (1 << self._half) - 1
+    if base is None:
+      base = hmask + 1
+    # We only use the half width LSB's of the map output, so wrap map if it
+    # is wider.
     cmax = max(map(chr(c)) for c in xrange(256))
-    if cmax > 0xffff:
-      _map = lambda c: map(c) & 0xffff
+    if cmax > hmask:
+      _map = lambda c: map(c) & hmask
       _map.__name__ = map.__name__
       cmax = max(_map(chr(c)) for c in xrange(256))
     else:
       _map = map
     self.base, self.sum2 = base, 0
     # Find the max updates without doing mod where sum2 doesn't overflow.
-    # Largest n such that n*(n+1)/2*(cmax+offs)+(n+1)*(base-1) <= 2^32-1.
+    # Largest n such that n*(n+1)/2*(cmax+offs)+(n+1)*(base-1) <= 2^width-1.
     # Where cmax is the largest possible map(c) value.
     # Solving using (-b + sqrt(b^2 - 4*a*c)) / (2*a).
     a = (cmax + offs)/2.0
     b = a + (base-1)
-    c = (base-1) - (2**32 - 1)
+    c = (base-1) - (2**width - 1)
     self._nmax = int((-b + (b**2 - 4*a*c)**0.5) / (2*a))
-    super(RollSum, self).__init__(data, seed, offs, _map)
+    super(RollSum, self).__init__(data, seed, offs, _map, width)
 
   def __str__(self):
-    return 'RollSum(seed=%s, offs=%s, map=%s, base=%#x)' % (
-        self.seed, self.offs, self.map.__name__, self.base)
+    return 'RollSum(seed=%s, offs=%s, map=%s, base=%#x%s)' % (
+        self.seed, self.offs, self.map.__name__, self.base, self._widthstr())
 
   def update(self, data):
-    size = len(data)
-    for i in xrange(0, size, self._nmax):
-      for c in data[i:i+self._nmax]:
-        self.sum += self.map(c)
-        self.sum2 += self.sum
-      n = min(self._nmax, size - i)
-      self.sum = (self.sum + n * self.offs) % self.base
-      self.sum2 = (self.sum2 + n * (n+1) / 2 * self.offs) % self.base
-    self.count += size
+    table, base, nmax = self._cmap, self.base, self._nmax
+    s1, s2 = self.sum, self.sum2
+    data = bytearray(data)
+    for i in xrange(0, len(data), nmax):
+      for c in data[i:i+nmax]:
+        s1 += table[c]
+        s2 += s1
+      s1, s2 = s1 % base, s2 % base
+    self.sum, self.sum2 = s1, s2
+    self.count += len(data)
 
   def rollin(self, cn):
-    self.sum += self.map(cn) + self.offs
-    # Note: timeit shows this is a little faster than "% self.base".
-    while self.sum >= self.base:
-      self.sum -= self.base
-    self.sum2 += self.sum
-    if self.sum2 >= self.base:
-      self.sum2 -= self.base
+    base = self.base
+    s1 = self.sum + self._cmap[ord(cn)]
+    # Note: timeit shows this is a little faster than "% base".
+    while s1 >= base:
+      s1 -= base
+    s2 = self.sum2 + s1
+    if s2 >= base:
+      s2 -= base
+    self.sum, self.sum2 = s1, s2
     self.count += 1
 
   def rollout(self, c1):
-    c1 = self.map(c1) + self.offs
-    self.sum -= c1
-    while self.sum < 0:
-      self.sum += self.base
-    self.sum2 -= self.count * c1 + self.seed
-    self.sum2 %= self.base
+    base = self.base
+    c1 = self._cmap[ord(c1)]
+    s1 = self.sum - c1
+    while s1 < 0:
+      s1 += base
+    self.sum = s1
+    self.sum2 = (self.sum2 - self.count * c1 - self.seed) % base
     self.count -= 1
 
   def rotate(self, c1, cn):
-    c1, cn = self.map(c1), self.map(cn)
-    self.sum += cn - c1
-    # Note: timeit shows this is a little faster than "%= self.base".
-    while self.sum >= self.base:
-      self.sum -= self.base
-    while self.sum < 0:
-      self.sum += self.base
-    self.sum2 += self.sum - (self.count * (c1 + self.offs) + self.seed)
-    self.sum2 %= self.base
+    base, table = self.base, self._cmap
+    c1 = table[ord(c1)]
+    s1 = self.sum + table[ord(cn)] - c1
+    # Note: timeit shows this is a little faster than "%= base".
+    while s1 >= base:
+      s1 -= base
+    while s1 < 0:
+      s1 += base
+    self.sum = s1
+    self.sum2 = (self.sum2 + s1 - self.count * c1 - self.seed) % base
+
+  def rotates(self, data, blocksize):
+    # This uses prefix sums p1 of the mapped bytes and p2 of p1. For the
+    # window data[i:i+n] sum is seed+p1[i+n]-p1[i] and sum2 is
+    # n*seed+p2[i+n]-p2[i]-n*p1[i], all mod base.
+    base, seed, n = self.base, self.seed, self.count
+    table, half = self._cmap, self._half
+    s1 = s2 = 0
+    p1, p2 = [0], [0]
+    for c in bytearray(data):
+      s1 = (s1 + table[c]) % base
+      s2 = (s2 + s1) % base
+      p1.append(s1)
+      p2.append(s2)
+    sums = []
+    for i in xrange(1, len(p1) - n):
+      s1 = (seed + p1[i+n] - p1[i]) % base
+      s2 = (n*seed + p2[i+n] - p2[i] - n*p1[i]) % base
+      sums.append((s2<<half) | s1)
+    if sums:
+      self.sum, self.sum2 = s1, s2
+    return sums
+
+  def _columndigests(self, data, blocksize):
+    # The column of the k'th byte of every block is added to all the block
+    # sums at once without doing mod, which is done at the end.
+    nblocks, get = len(data) // blocksize, self._cmap.__getitem__
+    s1, s2 = [self.sum] * nblocks, [self.sum2] * nblocks
+    data = bytearray(data)
+    for k in xrange(blocksize):
+      s1 = map(operator.add, s1, imap(get, data[k::blocksize]))
+      s2 = map(operator.add, s2, s1)
+    base, half = self.base, self._half
+    return [((b % base) << half) | (a % base) for a, b in izip(s1, s2)]
 
   def digest(self):
-    return (self.sum2<<16) | self.sum
+    return (self.sum2<<self._half) | self.sum
+
+  def combine(self, h_left, h_right, len_right):
+    """Get the digest of two concatenated blocks from their digests."""
+    base, seed, half = self.base, self.seed, self._half
+    hmask = (1 << half) - 1
+    s1a, s2a = h_left & hmask, h_left >> half
+    s1b, s2b = h_right & hmask, h_right >> half
+    s1 = (s1a + s1b - seed) % base
+    s2 = (s2a + s2b + len_right * (s1a - seed)) % base
+    return (s2<<half) | s1
+
+  def getstate(self):
+    """Get the (count, digest) state for restoring with setstate()."""
+    return self.count, self.digest()
+
+  def setstate(self, state):
+    """Restore the (count, digest) state from getstate() or combine()."""
+    self.count, h = state
+    self.sum, self.sum2 = h & ((1 << self._half) - 1), h >> self._half
 
 
 class RabinKarp(BaseHash):
   """Rabin-Karp rolling checksum (polyhash)."""
 
-  def __init__(self, data=None, seed=0, offs=0, map=ord, mult=0x08104225):
+  def __init__(self, data=None, seed=0, offs=0, map=ord, mult=None, width=32):
     """Initialize a Rabin-Karp rollsum calculator.
 
     Args:
@@ -117,90 +276,191 @@ class RabinKarp(BaseHash):
       seed: optional value to initialize sum with.
       offs: optional offset to add to each byte.
       map: optional mapping function to transform input bytes.
-      mult: optional Rabin-Karp multiplier to use (default: 0x08104225).
+      mult: optional Rabin-Karp multiplier to use (default: 0x08104225, or
+        0x5851f42d4c957f2d for width=64).
+      width: optional digest width in bits, 32 or 64.
     """
     # The rabinkarp multiplier.
+    if mult is None:
+      mult = 0x08104225 if width == 32 else 0x5851f42d4c957f2d
     self.mult = mult
-    # The modular 2^32 inverse of mult.
-    self.invm = modinv(mult, 1 << 32)
-    # Calc ajustment for rolling character out.
-    self._adj = offs + (mult - 1) * seed
+    # The modular 2^width inverse of mult.
+    self.invm = modinv(mult, 1 << width)
+    # Calc ajustment for rolling mapped character out.
+    self._adj = (mult - 1) * seed
     # Initialize multiplier for rolling character out to mult^count = 1.
     self._multn = 1
-    super(RabinKarp, self).__init__(data, seed, offs, map)
+    super(RabinKarp, self).__init__(data, seed, offs, map, width)
 
   def __str__(self):
-    return 'RabinKarp(seed=%s, offs=%s, map=%s, mult=%#x)' % (
-        self.seed, self.offs, self.map.__name__, self.mult)
+    return 'RabinKarp(seed=%s, offs=%s, map=%s, mult=%#x%s)' % (
+        self.seed, self.offs, self.map.__name__, self.mult, self._widthstr())
 
   def update(self, data):
-    for c in data:
-      self.sum = (self.sum * self.mult + self.map(c) + self.offs) & self.mask
+    table, mult, mask = self._cmap, self.mult, self.mask
+    h = self.sum
+    for c in bytearray(data):
+      h = (h * mult + table[c]) & mask
+    self.sum = h
     self.count += len(data)
-    self._multn = (self.mult ** self.count) & self.mask
+    self._multn = modpow(mult, self.count, mask + 1)
 
   def rollin(self, cn):
-    self.sum = (self.sum * self.mult + self.map(cn) + self.offs) & self.mask
+    self.sum = (self.sum * self.mult + self._cmap[ord(cn)]) & self.mask
     self.count += 1
     self._multn = (self._multn * self.mult) & self.mask
 
   def rollout(self, c1):
     self.count -= 1
     self._multn = (self._multn * self.invm) & self.mask
-    self.sum = (self.sum - self._multn * (self.map(c1) + self._adj)) & self.mask
+    self.sum = (self.sum - self._multn * (self._cmap[ord(c1)] + self._adj)) & self.mask
 
   def rotate(self, c1, cn):
-    c1, cn = self.map(c1) + self._adj, self.map(cn) + self.offs
+    table = self._cmap
+    c1, cn = table[ord(c1)] + self._adj, table[ord(cn)]
     self.sum = (self.sum * self.mult + cn - self._multn * c1) & self.mask
 
+  def rotates(self, data, blocksize):
+    # This uses prefix polynomials p of the mapped bytes. The sum for the
+    # window data[i:i+n] is p[i+n]-p[i]*mult^n+seed*mult^n.
+    mult, mask, multn = self.mult, self.mask, self._multn
+    adj = (self.seed * multn) & mask
+    table = self._cmap
+    h, p = 0, [0]
+    for c in bytearray(data):
+      h = (h * mult + table[c]) & mask
+      p.append(h)
+    n = self.count
+    sums = [(p[i+n] - p[i]*multn + adj) & mask for i in xrange(1, len(p) - n)]
+    if sums:
+      self.sum = sums[-1]
+    return sums
+
+  def _columndigests(self, data, blocksize):
+    # The sums of all the blocks are updated a byte column at a time.
+    nblocks, get = len(data) // blocksize, self._cmap.__getitem__
+    mults, masks = [self.mult] * nblocks, [self.mask] * nblocks
+    h = [self.sum] * nblocks
+    data = bytearray(data)
+    for k in xrange(blocksize):
+      h = map(operator.mul, h, mults)
+      h = map(operator.and_, map(operator.add, h, imap(get, data[k::blocksize])),
+              masks)
+    return h
+
+  def combine(self, h_left, h_right, len_right):
+    """Get the digest of two concatenated blocks from their digests."""
+    multn = modpow(self.mult, len_right, self.mask + 1)
+    return (multn * (h_left - self.seed) + h_right) & self.mask
+
+  def getstate(self):
+    """Get the (count, digest) state for restoring with setstate()."""
+    return self.count, self.digest()
+
+  def setstate(self, state):
+    """Restore the (count, digest) state from getstate() or combine()."""
+    self.count, self.sum = state
+    self._multn = modpow(self.mult, self.count, self.mask + 1)
+
 
 class CyclicPoly(BaseHash):
   """Cyclic Polynomial rolling checksum (buzzhash)."""
 
-  def __init__(self, data=None, seed=0, offs=0, map=ord):
+  _columnsize = 1024
+
+  def __init__(self, data=None, seed=0, offs=0, map=ord, width=32):
     # Calculate adjustment for rolling characters out.
     self._adj = (seed << 1) ^ seed
     # Initialise shift left and shift right for rolling characters out.
-    self._sl, self._sr = 0, 32
-    super(CyclicPoly, self).__init__(data, seed, offs, map)
+    self._sl, self._sr = 0, width
+    super(CyclicPoly, self).__init__(data, seed, offs, map, width)
 
   def __str__(self):
-    return 'CyclicPoly(seed=%s, offs=%s, map=%s)' % (
-        self.seed, self.offs, self.map.__name__)
+    return 'CyclicPoly(seed=%s, offs=%s, map=%s%s)' % (
+        self.seed, self.offs, self.map.__name__, self._widthstr())
 
   def _calcs(self):
-    self._sl = self.count & 31  # shift left for rotlC.
-    self._sr = 32 - self._sl    # shift right for rotlC.
+    self._sl = self.count % self.width  # shift left for rotlC.
+    self._sr = self.width - self._sl    # shift right for rotlC.
 
   def _rotlC(self, v):
     return ((v << self._sl) & self.mask) | (v >> self._sr)
 
   def _rotl1(self, v):
-    return ((v << 1) & self.mask) | (v >> 31)
+    return ((v << 1) & self.mask) | (v >> (self.width - 1))
 
   def update(self, data):
-    for c in data:
-      self.sum = self._rotl1(self.sum) ^ (self.map(c) + self.offs)
+    table, mask, top = self._cmap, self.mask, self.width - 1
+    h = self.sum
+    for c in bytearray(data):
+      h = (((h << 1) & mask) | (h >> top)) ^ table[c]
+    self.sum = h
     self.count += len(data)
     self._calcs()
 
   def rollin(self, cn):
-    self.sum = self._rotl1(self.sum) ^ (self.map(cn) + self.offs)
+    self.sum = self._rotl1(self.sum) ^ self._cmap[ord(cn)]
     self.count += 1
     self._calcs()
 
   def rollout(self, c1):
     self.count -= 1
     self._calcs()
-    self.sum = self.sum ^ self._rotlC((self.map(c1) + self.offs) ^ self._adj)
+    self.sum = self.sum ^ self._rotlC(self._cmap[ord(c1)] ^ self._adj)
 
   def rotate(self, c1, cn):
     #self.sum = rotl1(self.sum) ^ cn ^ rotlC(c1 ^ rotl1(seed) ^ seed)
-    c1, cn = (self.map(c1) + self.offs) ^ self._adj, self.map(cn) + self.offs
-    h = ((self.sum << 1) & self.mask) | (self.sum >> (32 - 1))
-    c1 = ((c1 << self._sl) & self.mask) | (c1 >> self._sr)
+    mask, table, h = self.mask, self._cmap, self.sum
+    c1, cn = table[ord(c1)] ^ self._adj, table[ord(cn)]
+    h = ((h << 1) & mask) | (h >> (self.width - 1))
+    c1 = ((c1 << self._sl) & mask) | (c1 >> self._sr)
     self.sum = h ^ cn ^ c1
 
+  def rotates(self, data, blocksize):
+    # This uses a table for rolling in, and a table pre-shifted by rotlC for
+    # rolling out, so each rotate is a rotl1 and two xor's.
+    mask, sl, sr, top = self.mask, self._sl, self._sr, self.width - 1
+    intable = self._cmap
+    outtable = [c ^ self._adj for c in intable]
+    outtable = [((c << sl) & mask) | (c >> sr) for c in outtable]
+    h, sums = self.sum, []
+    data = bytearray(data)
+    for c1, cn in izip(data, data[blocksize:]):
+      h = (((h << 1) & mask) | (h >> top)) ^ intable[cn] ^ outtable[c1]
+      sums.append(h)
+    self.sum = h
+    return sums
+
+  def _columndigests(self, data, blocksize):
+    # The sum after a block is the initial sum rotl'ed by blocksize xor'ed
+    # with each byte's value rotl'ed by the bytes after it. This uses tables
+    # pre-rotated by every amount, so each byte column of all the blocks is
+    # just a lookup and xor.
+    mask, width = self.mask, self.width
+    rotl = lambda v, n: ((v << n) & mask) | (v >> (width - n))
+    tables = [[rotl(v, n) for v in self._cmap] for n in xrange(width)]
+    h = [rotl(self.sum, blocksize % width)] * (len(data) // blocksize)
+    data = bytearray(data)
+    for k in xrange(blocksize):
+      get = tables[(blocksize - 1 - k) % width].__getitem__
+      h = map(operator.xor, h, imap(get, data[k::blocksize]))
+    return h
+
+  def combine(self, h_left, h_right, len_right):
+    """Get the digest of two concatenated blocks from their digests."""
+    sl = len_right % self.width
+    rotl = lambda v: ((v << sl) & self.mask) | (v >> (self.width - sl))
+    return rotl(h_left) ^ h_right ^ rotl(self.seed)
+
+  def getstate(self):
+    """Get the (count, digest) state for restoring with setstate()."""
+    return self.count, self.digest()
+
+  def setstate(self, state):
+    """Restore the (count, digest) state from getstate() or combine()."""
+    self.count, self.sum = state
+    self._calcs()
+
 
 class Gear(BaseHash):
   """Gear rolling checksum.
@@ -210,25 +470,33 @@ class Gear(BaseHash):
   naturally rolls data out by shifting it left for each byte rolled in. This
   means it is very fast and you don't need to keep a sliding window. It also
   means it can't really be used for checksumming a block of data, as it always
-  only checksums the last 32 bytes.
+  only checksums the last 32 bytes (or 64 bytes with width=64).
 
   Note that this is identical to RabinKarp with mult=2.
   """
 
-  def __init__(self, data=None, offs=0, map=ord):
-    super(Gear, self).__init__(data, 0, offs, map)
-    self.count = 32
+  # Each byte rolled in does sum = (sum*a + c*table[byte]) & mask.
+  _gearac = 2, 1
+  # Only the last width byte columns are used, so always use them.
+  _columnsize = float('inf')
+
+  def __init__(self, data=None, offs=0, map=ord, width=32):
+    super(Gear, self).__init__(data, 0, offs, map, width)
+    self.count = width
 
   def __str__(self):
-    return 'Gear(offs=%s, map=%s)' % (
-        self.offs, self.map.__name__)
+    return 'Gear(offs=%s, map=%s%s)' % (
+        self.offs, self.map.__name__, self._widthstr())
 
   def update(self, data):
-    for c in data:
-      self.sum = ((self.sum<<1) + self.map(c) + self.offs) & self.mask
+    table, mask = self._cmap, self.mask
+    h = self.sum
+    for c in bytearray(data):
+      h = ((h<<1) + table[c]) & mask
+    self.sum = h
 
   def rollin(self, cn):
-    self.sum = ((self.sum<<1) + self.map(cn) + self.offs) & self.mask
+    self.sum = ((self.sum<<1) + self._cmap[ord(cn)]) & self.mask
 
   def rollout(self, c1):
     pass
@@ -236,6 +504,34 @@ class Gear(BaseHash):
   def rotate(self, c1, cn):
     self.rollin(cn)
 
+  def rotates(self, data, blocksize):
+    # Bytes are rolled out by shifting, so only the rolled in bytes matter.
+    return self._rollins(data[blocksize:])
+
+  def _columndigests(self, data, blocksize):
+    # The sum after a block is sum*a^n + c*a^j*table[byte] for each byte
+    # rolled in j bytes before the end. Since a is even, only the last width
+    # byte columns of the blocks matter. This returns the sums, not digests.
+    a, c = self._gearac
+    mask, table, n = self.mask, self._cmap, blocksize
+    h = [(self.sum * modpow(a, n, mask + 1)) & mask] * (len(data) // n)
+    data = bytearray(data)
+    for j in xrange(min(n, self.width)):
+      coef = (c * modpow(a, j, mask + 1)) & mask
+      get = [v * coef for v in table].__getitem__
+      h = map(operator.add, h, imap(get, data[n-1-j::n]))
+    return [s & mask for s in h]
+
+  def _rollins(self, data):
+    """Rollin all of data returning a list of the sums after each byte."""
+    mask, table = self.mask, self._cmap
+    h, sums = self.sum, []
+    for c in bytearray(data):
+      h = ((h<<1) + table[c]) & mask
+      sums.append(h)
+    self.sum = h
+    return sums
+
 
 class RGear(BaseHash):
   """RGear rolling checksum.
@@ -256,34 +552,61 @@ class RGear(BaseHash):
   times in different hash buckets.
   """
 
-  def __init__(self, data=None, offs=0, map=ord):
-    # We only use 31 LSB's of the map output, so wrap map if it is >31bit.
+  _columnsize = 32
+
+  def __init__(self, data=None, offs=0, map=ord, width=32):
+    # We only use width-1 LSB's of the map output, so wrap map if it is wider.
+    cmask = (1 << (width - 1)) - 1
     cmax = max(map(chr(c)) for c in xrange(256))
-    if cmax > 0x7fffffff:
-      _map = lambda c: map(c) & 0x7fffffff
+    if cmax > cmask:
+      _map = lambda c: map(c) & cmask
       _map.__name__ = map.__name__
     else:
       _map = map
-    super(RGear, self).__init__(data, 0, offs, _map)
+    super(RGear, self).__init__(data, 0, offs, _map, width)
 
   def __str__(self):
-    return 'RGear(offs=%s, map=%s)' % (
-        self.offs, self.map.__name__)
+    return 'RGear(offs=%s, map=%s%s)' % (
+        self.offs, self.map.__name__, self._widthstr())
 
   def update(self, data):
-    for c in data:
-      self.sum = ((self.sum>>1) + self.map(c) + self.offs) & self.mask
+    table, mask = self._cmap, self.mask
+    h = self.sum
+    for c in bytearray(data):
+      h = ((h>>1) + table[c]) & mask
+    self.sum = h
     self.count += len(data)
 
   def rollin(self, cn):
-    self.sum = ((self.sum>>1) + self.map(cn) + self.offs) & self.mask
+    self.sum = ((self.sum>>1) + self._cmap[ord(cn)]) & self.mask
     self.count += 1
 
   def rollout(self, c1):
     self.count -= 1
 
   def rotate(self, c1, cn):
-    self.sum = ((self.sum>>1) + self.map(cn) + self.offs) & self.mask
+    self.sum = ((self.sum>>1) + self._cmap[ord(cn)]) & self.mask
+
+  def _columndigests(self, data, blocksize):
+    # The sums of all the blocks are updated a byte column at a time.
+    nblocks, get = len(data) // blocksize, self._cmap.__getitem__
+    ones, masks = [1] * nblocks, [self.mask] * nblocks
+    h = [self.sum] * nblocks
+    data = bytearray(data)
+    for k in xrange(blocksize):
+      h = map(operator.rshift, h, ones)
+      h = map(operator.and_, map(operator.add, h, imap(get, data[k::blocksize])),
+              masks)
+    return h
+
+  def rotates(self, data, blocksize):
+    mask, table = self.mask, self._cmap
+    h, sums = self.sum, []
+    for c in bytearray(data[blocksize:]):
+      h = ((h>>1) + table[c]) & mask
+      sums.append(h)
+    self.sum = h
+    return sums
 
 
 class UGear(Gear):
@@ -294,10 +617,21 @@ class UGear(Gear):
   """
 
   def __str__(self):
-    return 'UGear(offs=%s, map=%s)' % (self.offs, self.map.__name__)
+    return 'UGear(offs=%s, map=%s%s)' % (
+        self.offs, self.map.__name__, self._widthstr())
 
   def digest(self):
-    return (self.sum >> 12) | (self.sum << 20) & self.mask
+    return (self.sum >> (self.width - 20)) | (self.sum << 20) & self.mask
+
+  def rotates(self, data, blocksize):
+    mask, sr = self.mask, self.width - 20
+    sums = super(UGear, self).rotates(data, blocksize)
+    return [(h >> sr) | (h << 20) & mask for h in sums]
+
+  def _columndigests(self, data, blocksize):
+    mask, sr = self.mask, self.width - 20
+    sums = super(UGear, self)._columndigests(data, blocksize)
+    return [(h >> sr) | (h << 20) & mask for h in sums]
 
 
 class MGear(UGear):
@@ -307,15 +641,175 @@ class MGear(UGear):
   reduce the requirement for a good mapping.
   """
 
+  _gearac = 2*0x08104225, 0x08104225
+
   def __str__(self):
-    return 'MGear(offs=%s, map=%s)' % (self.offs, self.map.__name__)
+    return 'MGear(offs=%s, map=%s%s)' % (
+        self.offs, self.map.__name__, self._widthstr())
 
   def update(self, data):
-    for c in data:
-      self.sum = (((self.sum<<1) + self.map(c) + self.offs)*0x08104225) & self.mask
+    table, mask = self._cmap, self.mask
+    h = self.sum
+    for c in bytearray(data):
+      h = (((h<<1) + table[c])*0x08104225) & mask
+    self.sum = h
 
   def rollin(self, cn):
-    self.sum = (((self.sum<<1) + self.map(cn) + self.offs)*0x08104225) & self.mask
+    self.sum = (((self.sum<<1) + self._cmap[ord(cn)])*0x08104225) & self.mask
+
+  def _rollins(self, data):
+    mask, table = self.mask, self._cmap
+    h, sums = self.sum, []
+    for c in bytearray(data):
+      h = (((h<<1) + table[c])*0x08104225) & mask
+      sums.append(h)
+    self.sum = h
+    return sums
+
+
+class WindowIndex(object):
+  """Random access window digests using prefix arrays over some data.
+
+  The prefix arrays are built once in a single pass of the data, and then
+  the digest of any window data[i:i+blocksize] for any blocksize can be
+  calculated in O(1). The data is not kept, and the index can be saved to
+  and loaded from a file. Offsets are not range checked.
+
+  Subclasses provide build(data) to set size and the prefix arrays named in
+  _arrays, and digests(offsets, blocksize).
+  """
+
+  _arrays = ()
+
+  def __init__(self, rollsum):
+    self.rollsum = rollsum
+    # The prefix values fit in 32bit ints for 32bit rollsums, and need
+    # 'L' to be 64bit for 64bit rollsums.
+    self.typecode = 'I' if rollsum.width == 32 else 'L'
+    assert array(self.typecode).itemsize * 8 == rollsum.width
+    self.size = 0
+
+  def digest(self, i, blocksize):
+    """Get the digest of the window data[i:i+blocksize]."""
+    return self.digests([i], blocksize)[0]
+
+  def save(self, file, key=None):
+    """Save the index to a file object with an optional data key."""
+    header = dict(rollsum=str(self.rollsum), size=self.size, key=key)
+    cPickle.dump(header, file, 2)
+    for name in self._arrays:
+      getattr(self, name).tofile(file)
+
+  def load(self, file, key=None):
+    """Load the index from a file object saved with save().
+
+    Returns False without loading anything if the index was saved for a
+    different rollsum or data key.
+    """
+    header = cPickle.load(file)
+    if header['rollsum'] != str(self.rollsum) or header['key'] != key:
+      return False
+    self.size = header['size']
+    for name in self._arrays:
+      a = array(self.typecode)
+      a.fromfile(file, self.size + 1)
+      setattr(self, name, a)
+    return True
+
+
+class RollSumIndex(WindowIndex):
+  """Random access RollSum window digests using prefix sums.
+
+  This keeps the prefix sums p1 of the mapped bytes and p2 of p1. For the
+  window data[i:i+n] sum is seed+p1[i+n]-p1[i] and sum2 is
+  n*seed+p2[i+n]-p2[i]-n*p1[i], all mod base.
+  """
+
+  _arrays = ('p1', 'p2')
+
+  def __init__(self, rollsum, data=None):
+    super(RollSumIndex, self).__init__(rollsum)
+    self.p1, self.p2 = array(self.typecode), array(self.typecode)
+    if data is not None:
+      self.build(data)
+
+  def build(self, data):
+    """Build the prefix arrays for data."""
+    base, table = self.rollsum.base, self.rollsum._cmap
+    s1 = s2 = 0
+    p1, p2 = [0], [0]
+    for c in bytearray(data):
+      s1 = (s1 + table[c]) % base
+      s2 = (s2 + s1) % base
+      p1.append(s1)
+      p2.append(s2)
+    self.p1, self.p2 = array(self.typecode, p1), array(self.typecode, p2)
+    self.size = len(data)
+
+  def digests(self, offsets, blocksize):
+    """Get the digests of the blocksize windows at each of offsets."""
+    base, seed, n = self.rollsum.base, self.rollsum.seed, blocksize
+    p1, p2, nseed, half = self.p1, self.p2, n * seed, self.rollsum._half
+    return [((((nseed + p2[i+n] - p2[i] - n*p1[i]) % base) << half) |
+             ((seed + p1[i+n] - p1[i]) % base)) for i in offsets]
+
+
+class RabinKarpIndex(WindowIndex):
+  """Random access RabinKarp window digests using prefix polynomials.
+
+  This keeps the prefix polynomials p of the mapped bytes and the powers of
+  mult. The sum for the window data[i:i+n] is p[i+n]-p[i]*mult^n+seed*mult^n.
+  """
+
+  _arrays = ('p', 'powers')
+
+  def __init__(self, rollsum, data=None):
+    super(RabinKarpIndex, self).__init__(rollsum)
+    self.p, self.powers = array(self.typecode), array(self.typecode)
+    if data is not None:
+      self.build(data)
+
+  def build(self, data):
+    """Build the prefix arrays for data."""
+    mult, mask, table = self.rollsum.mult, self.rollsum.mask, self.rollsum._cmap
+    h, m = 0, 1
+    p, powers = [0], [1]
+    for c in bytearray(data):
+      h = (h * mult + table[c]) & mask
+      m = (m * mult) & mask
+      p.append(h)
+      powers.append(m)
+    self.p, self.powers = array(self.typecode, p), array(self.typecode, powers)
+    self.size = len(data)
+
+  def digests(self, offsets, blocksize):
+    """Get the digests of the blocksize windows at each of offsets."""
+    mask, p = self.rollsum.mask, self.p
+    multn = self.powers[blocksize]
+    adj = self.rollsum.seed * multn
+    return [(p[i+blocksize] - p[i]*multn + adj) & mask for i in offsets]
+
+
+def windowindex(rollsum, filename, cachefile=None):
+  """Get a WindowIndex for a RollSum or RabinKarp rollsum over a file.
+
+  If cachefile is given the index is loaded from it if it was saved for
+  the same rollsum and file contents, otherwise it is built and saved to it.
+  """
+  cls = RollSumIndex if isinstance(rollsum, RollSum) else RabinKarpIndex
+  index = cls(rollsum)
+  with open(filename, 'rb') as f:
+    data = f.read()
+  key = hashlib.sha1(data).hexdigest()
+  if cachefile and os.path.exists(cachefile):
+    with open(cachefile, 'rb') as f:
+      if index.load(f, key):
+        return index
+  index.build(data)
+  if cachefile:
+    with open(cachefile, 'wb') as f:
+      index.save(f, key)
+  return index
 
 
 inf = float('inf')
@@ -342,6 +836,14 @@ class Stats(object):
     for v in data:
       self.add(v)
 
+  def merge(self, other):
+    """Merge the stats from another Stats instance into this one."""
+    self.num += other.num
+    self.sum += other.sum
+    self.sum2 += other.sum2
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+
   @property
   def avg(self):
     return float(self.sum) / self.num
@@ -360,7 +862,21 @@ class Stats(object):
 
 
 class TableStats(Stats):
-  """Statistics for hastable performance."""
+  """Statistics for hastable performance.
+
+  This also keeps a histogram of bucket sizes to bucket counts. Tables can
+  add each distinct bucket size once with its count, so calculating the
+  stats only costs O(number of distinct bucket sizes).
+  """
+
+  def __init__(self, data=None):
+    self.hist = {}
+    super(TableStats, self).__init__(data)
+
+  def add(self, v, num=1):
+    if num:
+      self.hist[v] = self.hist.get(v, 0) + num
+      super(TableStats, self).add(v, num)
 
   def addempty(self, size):
       # Get the number of empty buckets and collisions.
@@ -397,6 +913,10 @@ class TableStats(Stats):
   def empty(self):
     return float(self.num_empty) / self.size
 
+  def histogram(self):
+    """Get the bucket size histogram as a "size:count ..." str."""
+    return ' '.join('%s:%s' % i for i in sorted(self.hist.iteritems()))
+
   def __str__(self):
     return "size=%s count=%s min/avg/max/dev=%s/%s/%s/%s empty=%.6f colls=%.6f perf=%.4f" % (
         self.size, self.count, self.min, self.avg, self.max, self.dev, self.empty, self.colls, self.perf)
@@ -413,11 +933,22 @@ class HashTable(object):
   def add(self, key, value):
     self.data.setdefault(self.hash(key), set()).add(value)
 
+  def merge(self, other):
+    """Merge the entries from another table of the same type into this one."""
+    for k, v in other.data.iteritems():
+      self.data.setdefault(k, set()).update(v)
+
+  def __getstate__(self):
+    # The hash function is often a lambda that cannot be pickled.
+    state = self.__dict__.copy()
+    del state['hash']
+    return state
+
   def stats(self):
     stats = TableStats()
-    # Add all the used table buckets.
-    for v in self.data.itervalues():
-      stats.add(len(v))
+    # Add all the used table buckets by bucket size.
+    for n, num in Counter(imap(len, self.data.itervalues())).iteritems():
+      stats.add(n, num)
     # Add all the empty table buckets.
     stats.addempty(self.size)
     return stats
@@ -426,6 +957,393 @@ class HashTable(object):
     return str(self.stats())
 
 
+class ArrayHashTable(HashTable):
+  """Compact Hashtable for collecting hash collision stats.
+
+  This stores the (bucket, value) entries in packed arrays of 64bit unsigned
+  ints instead of a dict of sets, using 24 bytes per entry. Values can be
+  ints upto 128 bits (eg from polyids) or strs (eg from md5ids). Duplicate
+  entries are removed whenever the arrays double in size, and the distinct
+  values in each bucket are counted when stats() is called, giving
+  identical results to HashTable.
+  """
+
+  # The approximate number of entries to sort at a time.
+  sortsize = 2**20
+
+  def __init__(self, size, hashfunc):
+    self.size = size
+    self.hash = hashfunc
+    self.buckets, self.his, self.los = array('L'), array('L'), array('L')
+    assert self.buckets.itemsize == 8
+    # Remove duplicate entries when there are more than this.
+    self.limit = self.sortsize
+
+  def add(self, key, value):
+    if isinstance(value, str):
+      value = int(hexlify(value), 16)
+    self.buckets.append(self.hash(key))
+    self.his.append(value >> 64)
+    self.los.append(value & 0xffffffffffffffff)
+    if len(self.los) > self.limit:
+      self.compact()
+
+  def merge(self, other):
+    self.buckets.extend(other.buckets)
+    self.his.extend(other.his)
+    self.los.extend(other.los)
+    if len(self.los) > self.limit:
+      self.compact()
+
+  def entries(self):
+    """Iterate over the distinct entries in sorted order.
+
+    Each entry is returned as a (bucket << 128 | hi << 64 | lo) long. The
+    entries are counting sorted into ranges of buckets with about sortsize
+    entries each, so only one range at a time is sorted as a list instead of
+    every entry.
+    """
+    buckets, his, los, size = self.buckets, self.his, self.los, self.size
+    parts = max(1, -(-len(buckets) // self.sortsize))
+    if parts == 1:
+      ranges = [izip(buckets, his, los)]
+    else:
+      # Get the start index of each range in the entry order.
+      starts = [0] * (parts + 1)
+      for b in buckets:
+        starts[b * parts // size + 1] += 1
+      for p in xrange(parts):
+        starts[p + 1] += starts[p]
+      # Get the entry indexes ordered by range.
+      order, ends = array('L', [0]) * len(buckets), starts[:-1]
+      for i, b in enumerate(buckets):
+        p = b * parts // size
+        order[ends[p]] = i
+        ends[p] += 1
+      ranges = (((buckets[i], his[i], los[i])
+                 for i in order[starts[p]:starts[p + 1]])
+                for p in xrange(parts))
+    for entries in ranges:
+      last = None
+      for e in sorted((b << 128) | (h << 64) | l for b, h, l in entries):
+        if e != last:
+          yield e
+          last = e
+
+  def compact(self):
+    """Remove the duplicate entries, leaving them sorted."""
+    buckets, his, los = array('L'), array('L'), array('L')
+    for e in self.entries():
+      buckets.append(e >> 128)
+      his.append((e >> 64) & 0xffffffffffffffff)
+      los.append(e & 0xffffffffffffffff)
+    self.buckets, self.his, self.los = buckets, his, los
+    self.limit = max(self.sortsize, 2 * len(los))
+
+  def stats(self):
+    stats = TableStats()
+    # Count the distinct values in each used table bucket.
+    hist = Counter()
+    bucket, num = None, 0
+    for e in self.entries():
+      if e >> 128 != bucket:
+        hist[num] += 1
+        bucket, num = e >> 128, 0
+      num += 1
+    hist[num] += 1
+    # Remove the size 0 "bucket" counted before the first entry.
+    del hist[0]
+    # Add all the used table buckets by bucket size.
+    for n, num in hist.iteritems():
+      stats.add(n, num)
+    # Add all the empty table buckets.
+    stats.addempty(self.size)
+    return stats
+
+
+class ProbeStats(object):
+  """Statistics for open addressing hashtable probe lengths.
+
+  The found stats are for looking up each entry in the table, and the missed
+  stats are for looking up a missing key starting at each slot. Each also
+  has a histogram of probe lengths to counts.
+  """
+
+  def __init__(self, size, found, missed):
+    self.size = size
+    self.count = found.num
+    self.found, self.missed = found, missed
+
+  @property
+  def load(self):
+    return float(self.count) / self.size
+
+  def histogram(self):
+    """Get the probe length histograms as a "found ... missed ..." str."""
+    return 'found %s missed %s' % (self.found.histogram(),
+                                   self.missed.histogram())
+
+  def __str__(self):
+    f, m = self.found, self.missed
+    return "size=%s count=%s load=%.6f found=%.4f/%.4f/%s missed=%.4f/%.4f/%s" % (
+        self.size, self.count, self.load, f.avg, f.dev, f.max, m.avg, m.dev, m.max)
+
+
+class ProbeTable(HashTable):
+  """Open addressing Hashtable for collecting probe length stats.
+
+  Distinct (key, value) entries are inserted at the slot hashfunc(key) using
+  linear or quadratic (triangular number) probing, like librsync's original
+  hashtable. The probe length for finding each entry is recorded when it is
+  inserted, and the probe lengths for missing keys are calculated from every
+  start slot when stats() is called. Quadratic probing only visits every slot
+  if size is a power of 2.
+  """
+
+  def __init__(self, size, hashfunc, probe='linear'):
+    assert probe in ('linear', 'quadratic')
+    self.size = size
+    self.hash = hashfunc
+    self.probe = probe
+    self.keys, self.values = [None] * size, [None] * size
+    self.found = Counter()
+
+  def add(self, key, value):
+    keys, values, size = self.keys, self.values, self.size
+    quadratic = self.probe == 'quadratic'
+    slot, n = self.hash(key), 1
+    while keys[slot] is not None:
+      if keys[slot] == key and values[slot] == value:
+        return
+      if n >= size:
+        raise ValueError('ProbeTable is full.')
+      slot = (slot + (n if quadratic else 1)) % size
+      n += 1
+    keys[slot], values[slot] = key, value
+    self.found[n] += 1
+
+  def merge(self, other):
+    """Merge the entries from another ProbeTable into this one.
+
+    The entries are inserted in other's slot order, so the probe lengths can
+    differ from inserting everything into a single table.
+    """
+    for key, value in izip(other.keys, other.values):
+      if key is not None:
+        self.add(key, value)
+
+  def missed(self):
+    """Get a Counter of the probe lengths for a missing key from each slot."""
+    keys, size = self.keys, self.size
+    missed = Counter()
+    if None not in keys:
+      raise ValueError('ProbeTable is full.')
+    if self.probe == 'linear':
+      # Scan backwards from an empty slot counting the run of used slots.
+      empty = keys.index(None)
+      n = 0
+      for i in xrange(empty, empty - size, -1):
+        n = n + 1 if keys[i] is not None else 1
+        missed[n] += 1
+    else:
+      for start in xrange(size):
+        slot, n = start, 1
+        while keys[slot] is not None and n < size:
+          slot = (slot + n) % size
+          n += 1
+        missed[n] += 1
+    return missed
+
+  def stats(self):
+    found, missed = TableStats(), TableStats()
+    for n, num in self.found.iteritems():
+      found.add(n, num)
+    for n, num in self.missed().iteritems():
+      missed.add(n, num)
+    return ProbeStats(self.size, found, missed)
+
+
+class HyperLogLog(object):
+  """HyperLogLog estimator for the number of distinct 64bit hashes added.
+
+  This uses 2^bits registers of one byte each, and has a relative standard
+  error of about 1.04/sqrt(2^bits). Small counts use linear counting of the
+  empty registers, which is much more accurate.
+  """
+
+  def __init__(self, bits=14):
+    self.bits = bits
+    self.regs = bytearray(1 << bits)
+
+  def add(self, h):
+    """Add a uniformly distributed 64bit hash."""
+    rbits = 64 - self.bits
+    i, w = h >> rbits, h & ((1 << rbits) - 1)
+    rank = rbits - w.bit_length() + 1
+    if rank > self.regs[i]:
+      self.regs[i] = rank
+
+  def merge(self, other):
+    """Merge the registers of another HyperLogLog into this one."""
+    self.regs = bytearray(imap(max, self.regs, other.regs))
+
+  @property
+  def err(self):
+    return 1.04 / sqrt(len(self.regs))
+
+  def count(self):
+    """Get the estimated number of distinct hashes added."""
+    m = len(self.regs)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    est = alpha * m * m / sum(2.0**-r for r in self.regs)
+    zeros = self.regs.count('\0')
+    if est <= 2.5 * m and zeros:
+      est = m * log(float(m) / zeros)
+    return est
+
+
+class SketchStats(TableStats):
+  """Estimated hashtable stats from a SketchTable.
+
+  The samples is the number of sampled buckets the bucket size histogram was
+  estimated from, and used_err is the relative standard error of the number
+  of used buckets, which is 0 if they were counted exactly. The err is the
+  approximate relative standard error of perf, and is 0 if all the used
+  buckets were sampled and counted exactly.
+  """
+
+  def __init__(self, samples, used_err):
+    self.samples, self.used_err = samples, used_err
+    super(SketchStats, self).__init__()
+
+  @property
+  def err(self):
+    e = sqrt(2.0/self.samples) if self.samples < self.num - self.num_empty else 0
+    return sqrt(e*e + self.used_err*self.used_err)
+
+  @property
+  def weight(self):
+    # The weight depends on the samples, not the table size.
+    return -log(self.err) if self.err else super(SketchStats, self).weight
+
+  def __str__(self):
+    return "%s samples=%s err=%.4f" % (
+        super(SketchStats, self).__str__(), self.samples, self.err)
+
+
+# The 256 byte values' bit counts for counting bits in bitmaps.
+_popcount = [bin(i).count('1') for i in xrange(256)]
+
+# The salt for sampling bucket hashes independently of HyperLogLog hashes.
+_sample_salt = 0x9e3779b97f4a7c15
+
+class SketchTable(HashTable):
+  """Fixed memory Hashtable for estimating hash collision stats.
+
+  This never stores all the entries, so it can be used with huge or
+  unlimited blockcounts. The used buckets are counted exactly with a bitmap
+  for tables upto 2^24 buckets (2MB), or estimated with a HyperLogLog for
+  larger tables. The bucket size histogram is estimated from a bottom-k
+  sample of the used buckets, keeping the distinct values of the buckets
+  with the smallest hashes. Buckets are dropped from the sample to keep it
+  below samples buckets and entries values, so heavily loaded tables have
+  fewer samples. Each sampled bucket's size is exact because a bucket that
+  ends up sampled was always sampled, so the only errors are from sampling
+  and the used bucket count. The stats() are a SketchStats with these error
+  bounds.
+  """
+
+  def __init__(self, size, hashfunc, samples=2**14, entries=2**16, bits=14):
+    self.size = size
+    self.hash = hashfunc
+    self.samples, self.entries = samples, entries
+    if size <= 2**24:
+      self.bitmap, self.hll = bytearray((size + 7) // 8), None
+    else:
+      self.bitmap, self.hll = None, HyperLogLog(bits)
+    # The sampled buckets' values, a max-heap of (-hash, bucket), and the
+    # number of sampled values.
+    self.sample, self.heap, self.count = {}, [], 0
+    # The maximum hash of sampled buckets, which is reduced when buckets are
+    # dropped from the sample.
+    self.limit = 2**64
+
+  def _drop(self):
+    """Drop sampled buckets with the largest hashes to fit the limits."""
+    sample, heap = self.sample, self.heap
+    while heap and (-heap[0][0] > self.limit or len(heap) > self.samples or
+                    (self.count > self.entries and len(heap) > 1)):
+      h, b = heappop(heap)
+      self.count -= len(sample.pop(b))
+      self.limit = min(self.limit, -h - 1)
+
+  def add(self, key, value):
+    b = self.hash(key)
+    if self.hll is None:
+      self.bitmap[b >> 3] |= 1 << (b & 7)
+    else:
+      self.hll.add(mix64(b))
+    h = mix64(b ^ _sample_salt)
+    if h <= self.limit:
+      values = self.sample.get(b)
+      if values is None:
+        values = self.sample[b] = set()
+        heappush(self.heap, (-h, b))
+      n = len(values)
+      values.add(value)
+      self.count += len(values) - n
+      if len(self.heap) > self.samples or self.count > self.entries:
+        self._drop()
+
+  def merge(self, other):
+    if self.hll is None:
+      n = 2 * len(self.bitmap)
+      bits = int(hexlify(self.bitmap), 16) | int(hexlify(other.bitmap), 16)
+      self.bitmap = bytearray(unhexlify('%0*x' % (n, bits)))
+    else:
+      self.hll.merge(other.hll)
+    # Buckets over either limit may be missing values from the other table.
+    self.limit = min(self.limit, other.limit)
+    for b, values in other.sample.iteritems():
+      if b in self.sample:
+        self.count -= len(self.sample[b])
+        self.sample[b].update(values)
+      else:
+        self.sample[b] = set(values)
+        self.heap.append((-mix64(b ^ _sample_salt), b))
+      self.count += len(self.sample[b])
+    heapify(self.heap)
+    self._drop()
+
+  def used(self):
+    """Get the number of used buckets, exact if there is a bitmap."""
+    if self.limit == 2**64:
+      # All the used buckets are in the sample.
+      return len(self.sample)
+    if self.hll is None:
+      return sum(imap(_popcount.__getitem__, self.bitmap))
+    return self.hll.count()
+
+  def stats(self):
+    n = len(self.sample)
+    exact = self.hll is None or self.limit == 2**64
+    stats = SketchStats(n, 0 if exact else self.hll.err)
+    # Scale the sampled bucket size counts to the number of used buckets,
+    # rounding so they still add up to it.
+    used = int(round(self.used()))
+    hist = Counter(imap(len, self.sample.itervalues()))
+    counts = dict((size, num * used // n) for size, num in hist.iteritems())
+    extra = used - sum(counts.itervalues())
+    for size in sorted(hist, key=lambda s: (-(hist[s] * used % n), s))[:extra]:
+      counts[size] += 1
+    # Add all the used table buckets by bucket size.
+    for size, num in counts.iteritems():
+      stats.add(size, num)
+    # Add all the empty table buckets.
+    stats.addempty(self.size)
+    return stats
+
+
 def mix32(i):
   """MurmurHash3 mix32 finalizer."""
   i ^= i >> 16
@@ -435,9 +1353,43 @@ def mix32(i):
   i ^= i >> 16
   return i
 
+def mix64(i):
+  """MurmurHash3 fmix64 finalizer."""
+  i ^= i >> 33
+  i = (i * 0xff51afd7ed558ccd) & 0xffffffffffffffff
+  i ^= i >> 33
+  i = (i * 0xc4ceb9fe1a85ec53) & 0xffffffffffffffff
+  i ^= i >> 33
+  return i
+
 def md5sum(data):
   return md5.new(data).digest()
 
+def md5ids(data, blocksize):
+  """Window identities using the md5sum of every blocksize window in data."""
+  return [md5sum(buffer(data, i, blocksize))
+          for i in xrange(len(data) - blocksize + 1)]
+
+# Modulus and multiplier for polyids, a Mersenne prime and a random constant.
+_polyid_mod = 2**127 - 1
+_polyid_mult = 0x2f0b3a5c9d41e7f6810c6b5a3d27e9c1
+
+def polyids(data, blocksize):
+  """Window identities using a 127bit fingerprint of every blocksize window.
+
+  This is a RabinKarp polyhash mod the prime 2^127-1 calculated using prefix
+  polynomials, so it costs O(1) per window regardless of blocksize. The chance
+  of two different windows colliding is less than blocksize/2^127.
+  """
+  p, m = _polyid_mod, _polyid_mult
+  mn = modpow(m, blocksize, p)
+  h, prefix = 0, [0]
+  for c in bytearray(data):
+    h = (h * m + c + 1) % p
+    prefix.append(h)
+  return [(prefix[i+blocksize] - prefix[i]*mn) % p
+          for i in xrange(len(data) - blocksize + 1)]
+
 def pow(c):
   """Rollsum map(c)->c^2 function."""
   c = ord(c)
@@ -504,98 +1456,448 @@ _ipfs_map = [
 def ipfs(c):
   return _ipfs_map[ord(c)]
 
-def runtest(rollsum, infile, blocksize=1024, blockcount=10000, tables=()):
-  """Run a test using a rollsum instance collecting stats in multiple tables."""
-  # Read first block and initialize data stats.
-  data = infile.read(blocksize)
-  datastats = Stats(rollsum.map(c) for c in data)
-  # Add first block to rollsum and hashtables.
-  rollsum.update(data)
-  key, value = rollsum.digest(), md5sum(data)
-  for t in tables:
-    t.add(key, value)
-  blockcount -= 1
-  # Roll through the rest of the input one char at a time.
-  c = infile.read(1)
-  while c and blockcount:
-    # Update data stats, rollsum, and hash tables.
-    datastats.add(rollsum.map(c))
-    rollsum.rotate(data[0],c)
-    data = data[1:] + c
-    key, value = rollsum.digest(), md5sum(data)
-    for t in tables:
-      t.add(key, value)
-    blockcount -= 1
-    c = infile.read(1)
+def tablemap(table, name):
+  """Get a named rollsum map function for a 256 entry table."""
+  def map(c):
+    return table[ord(c)]
+  map.__name__ = name
+  return map
+
+def loadmap(filename):
+  """Get a tablemap() from a file of 256 whitespace separated ints.
+
+  The map is named after the file without its directory or extension.
+  """
+  with open(filename) as f:
+    table = [int(v, 0) for v in f.read().split()]
+  assert len(table) == 256
+  return tablemap(table, os.path.splitext(os.path.basename(filename))[0])
+
+def bytecounts(data, counts=None):
+  """Count how many times each byte value occurs in data."""
+  if counts is None:
+    counts = [0] * 256
+  for c in bytearray(data):
+    counts[c] += 1
+  return counts
+
+class Phases(object):
+  """Cumulative time and call counts for the phases of test runs.
+
+  This also records the total elapsed time, bytes read, and the peak memory
+  use of the process.
+  """
+
+  def __init__(self):
+    self.times, self.calls = Counter(), Counter()
+    self.elapsed, self.size, self.maxrss = 0.0, 0, 0
+
+  def add(self, phase, t, calls=1):
+    """Add the time t and number of calls for a phase."""
+    self.times[phase] += t
+    self.calls[phase] += calls
+
+  def done(self, elapsed, size):
+    """Add the elapsed time and size of a run, and update maxrss."""
+    self.elapsed += elapsed
+    self.size += size
+    # Linux ru_maxrss is in KB.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    self.maxrss = max(self.maxrss, rss)
+
+  def merge(self, other):
+    """Merge the phase times, calls, and maxrss of a worker into this one."""
+    self.times.update(other.times)
+    self.calls.update(other.calls)
+    self.maxrss = max(self.maxrss, other.maxrss)
+
+  def phases(self):
+    """Get a list of "phase: time=... calls=... pct=..." strs."""
+    total = max(self.elapsed, sum(self.times.itervalues()), 1e-9)
+    return ['%s: time=%.3fs calls=%s pct=%.1f' % (
+        p, t, self.calls[p], 100.0 * t / total)
+            for p, t in sorted(self.times.iteritems(), key=lambda i: -i[1])]
+
+  def __str__(self):
+    return "time=%.3fs size=%s MB/s=%.3f maxrss=%.1fMB" % (
+        self.elapsed, self.size, self.size / max(self.elapsed, 1e-9) / 2**20,
+        self.maxrss / 2.0**20)
+
+
+def runtest(rollsum, infile, blocksize=1024, blockcount=10000, tables=(),
+            chunksize=2**20, winid=md5ids, phases=None):
+  """Run a test using a rollsum instance collecting stats in multiple tables.
+
+  The winid function is used to get the values that identify distinct
+  windows in the tables, and defaults to md5ids.
+
+  The infile can be a file object to read from, or an mmap or buffer that is
+  used directly without copying it into strs.
+
+  If a Phases instance is given, the time and calls for reading, counting
+  bytes, getting window ids, rolling, and adding to tables are added to it.
+
+  If blocksize is a list of blocksizes, tables must be a list with the tables
+  for each blocksize, and a copy of rollsum is used for each blocksize. They
+  are all run in a single pass of the input, and the returned data stats are
+  for all the input read.
+  """
+  if isinstance(blocksize, (int, long)):
+    tests = [(rollsum, blocksize, tables)]
+  else:
+    tests = [(copy(rollsum), b, t) for b, t in izip(blocksize, tables)]
+  return runtests(tests, infile, blockcount, chunksize, winid, phases)[0]
+
+def runtests(tests, infile, blockcount=10000, chunksize=2**20, winid=md5ids,
+             phases=None):
+  """Run multiple tests over a single pass of the input.
+
+  Each test is a (rollsum, blocksize, tables) tuple with its own rollsum
+  instance. The input reading and window identities for each blocksize are
+  shared by all the tests. Returns a list of the data stats for each test.
+  """
+  groups = {}
+  for rollsum, blocksize, tables in tests:
+    groups.setdefault(blocksize, []).append((rollsum, tables))
+  if phases is None:
+    phases = Phases()
+  t = time.time()
+  counts = _runtests(infile, sorted(groups.items()), blockcount, chunksize,
+                     winid, phases)
+  phases.done(time.time() - t, sum(counts))
+  return [countstats(counts, rollsum.map) for rollsum, _, _ in tests]
+
+def _runtests(infile, groups, blockcount, chunksize, winid, phases):
+  """Roll through infile for a list of (blocksize, [(rollsum, tables),...]).
+
+  All the rollsums with the same blocksize share the window identities. This
+  returns the bytecounts() for all the input read, and adds the time and
+  calls for each phase to phases.
+  """
+  maxsize = max(b for b, _ in groups)
+  # Mapped input is used directly instead of reading and copying chunks.
+  mapped = isinstance(infile, (mmap.mmap, buffer))
+  # Read first block and initialize byte counts for data stats.
+  if mapped:
+    data, pos = infile, min(maxsize, len(infile))
+  else:
+    data = infile.read(maxsize)
+    pos = len(data)
+  counts = bytecounts(buffer(data, 0, pos))
+  # Add first block to rollsums and hashtables. If the input is shorter
+  # than the block, the partial block is used as the only window.
+  for blocksize, tests in groups:
+    n = min(blocksize, pos)
+    value = winid(buffer(data, 0, n), n)[0]
+    for rollsum, tables in tests:
+      rollsum.update(data[:blocksize])
+      key = rollsum.digest()
+      for t in tables:
+        t.add(key, value)
+  # Roll through the rest of the input a chunk at a time. Each chunk is
+  # appended to the last maxsize bytes so windows are just buffers into data.
+  base, end = 0, maxsize + blockcount - 1
+  # The input offset of the end of the last window for each blocksize.
+  lasts = [blocksize for blocksize, _ in groups]
+  while True:
+    for i, (blocksize, tests) in enumerate(groups):
+      # Get the data from the last window to the end of this blocksize.
+      start, stop = lasts[i] - blocksize, min(pos, blocksize + blockcount - 1)
+      if stop <= lasts[i]:
+        continue
+      window = buffer(data, start - base, stop - start)
+      t0 = time.time()
+      values = winid(buffer(window, 1), blocksize)
+      t1 = time.time()
+      phases.add('winid', t1 - t0)
+      for rollsum, tables in tests:
+        keys = rollsum.rotates(window, blocksize)
+        t2 = time.time()
+        for key, value in izip(keys, values):
+          for t in tables:
+            t.add(key, value)
+        t3 = time.time()
+        phases.add('rollsum', t2 - t1)
+        phases.add('tables', t3 - t2, len(keys) * len(tables))
+        t1 = t3
+      lasts[i] = stop
+    t0 = time.time()
+    if mapped:
+      chunk = buffer(data, pos, min(chunksize, end - pos))
+    else:
+      chunk = infile.read(min(chunksize, end - pos))
+    t1 = time.time()
+    phases.add('read', t1 - t0)
+    if not chunk:
+      break
+    bytecounts(chunk, counts)
+    if not mapped:
+      data = data[-maxsize:] + chunk
+      base = pos + len(chunk) - len(data)
+    pos += len(chunk)
+    phases.add('bytecounts', time.time() - t1)
+  return counts
+
+def countstats(counts, map):
+  """Get the Stats of mapped byte values from their bytecounts()."""
+  stats = Stats()
+  for c, n in enumerate(counts):
+    stats.add(map(chr(c)), n)
+  return stats
+
+# The forkmap() function and arguments for _forkcall() in the workers.
+_forkargs = None
+
+def _forkcall(i):
+  func, args = _forkargs
+  return func(args, i)
+
+def forkmap(func, args, count, jobs, ordered=True):
+  """Iterate over func(args, i) for i in xrange(count) using jobs processes.
+
+  The workers are forked so they get copies of func and args without
+  pickling, and only i and the results are pickled. If ordered is False the
+  results are returned as they complete. The workers are reaped when the
+  iteration finishes or is abandoned.
+  """
+  global _forkargs
+  _forkargs = func, args
+  pool = Pool(jobs)
+  try:
+    imap = pool.imap if ordered else pool.imap_unordered
+    for result in imap(_forkcall, xrange(count)):
+      yield result
+    pool.close()
+  except:
+    # Don't wait for the remaining work on errors or early exits.
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+    _forkargs = None
+
+def _runshard(args, i):
+  """Run runtest() on shard i of the runshards() args.
+
+  Returns the data stats, tables, and Phases for the shard.
+  """
+  rollsum, data, blocksize, bounds, tables, winid = args
+  start, end = bounds[i], bounds[i+1]
+  shard = buffer(data, start, end + blocksize - 1 - start)
+  # Gear variants include upto width bytes before the window, so roll in
+  # the bytes before the shard that the serial run would include. RGear
+  # can include any earlier byte, but a different starting sum is shifted
+  # out after width bytes, leaving at most a carry of 1 that has about a
+  # 1/2 chance of dying each byte, so rolling in 4*width bytes gives the
+  # serial run's sum with probability about 1-2^-(3*width).
+  if isinstance(rollsum, RGear):
+    lead = min(start, 4 * rollsum.width)
+  elif isinstance(rollsum, Gear):
+    lead = min(start, rollsum.width - blocksize)
+  else:
+    lead = 0
+  if lead > 0:
+    rollsum = copy(rollsum)
+    rollsum.update(buffer(data, start - lead, lead))
+  phases = Phases()
+  runtest(rollsum, shard, blocksize, end - start, tables, winid=winid,
+          phases=phases)
+  # Only count data bytes not already counted by the previous shard.
+  skip = blocksize - 1 if i else 0
+  datastats = countstats(bytecounts(buffer(shard, skip)), rollsum.map)
+  return datastats, tables, phases
+
+def runshards(rollsum, data, blocksize=1024, blockcount=10000, tables=(),
+              jobs=2, winid=md5ids, phases=None):
+  """Run a test like runtest() split over multiple processes.
+
+  The windows in data are split into shards that overlap by blocksize-1
+  bytes, and each shard is run in a separate worker process. The stats and
+  tables from each shard are merged to give the same results as runtest().
+  Gear variants with blocksize < width first roll in the bytes before each
+  shard, and RGear rolls in 4*width bytes before each shard to reproduce
+  the carries from earlier bytes, so this matches runtest() for all the
+  rollsums (for RGear with a negligible chance of failing).
+
+  If a Phases instance is given, the phases of all the workers are merged
+  into it, so the phase times are the total of all the workers and the
+  elapsed time is the wall time.
+  """
+  blockcount = max(0, min(blockcount, len(data) - blocksize + 1))
+  # Use at most one job per window so no shards are empty.
+  jobs = max(1, min(jobs, blockcount))
+  bounds = [blockcount * i // jobs for i in xrange(jobs + 1)]
+  args = rollsum, data, blocksize, bounds, tables, winid
+  start = time.time()
+  datastats = Stats()
+  results = forkmap(_runshard, args, jobs, jobs)
+  for shardstats, shardtables, shardphases in results:
+    datastats.merge(shardstats)
+    for t, shardtable in izip(tables, shardtables):
+      t.merge(shardtable)
+    if phases is not None:
+      phases.merge(shardphases)
+  if phases is not None:
+    phases.done(time.time() - start, blockcount + blocksize - 1)
   return datastats
 
+# The rollsum classes and maps by their command line names.
+classes = dict(rs=RollSum, rk=RabinKarp, cp=CyclicPoly, gr=Gear, rg=RGear,
+               mg=MGear, ug=UGear)
+maps = dict(ord=ord, pow=pow, mul=mul, mix=mix, lcg=lcg, ipfs=ipfs)
+
+def sizearg(s):
+  """Parser for size arguments like "64K"."""
+  scales='BKMGT'
+  if s[-1] in scales:
+    return int(s[:-1]) * 1024**(scales.find(s[-1]))
+  else:
+    return int(s)
+
+def maparg(s):
+  """Parser for --map arguments, a maps name or a map table file."""
+  if os.path.isfile(s):
+    return loadmap(s)
+  try:
+    return maps[s]
+  except KeyError:
+    raise ValueError(s)
+
+def indexfuncs(bits, width=32):
+  """Get the and, mod, and mix hashtable index functions by name.
+
+  Each maps a width bit digest to a table index of bits bits.
+  """
+  mask = 2**bits - 1
+  mixn = mix64 if width == 64 else mix32
+  return {'and': lambda k: k & mask, 'mod': lambda k: k % mask,
+          'mix': lambda k: mixn(k) & mask}
+
 
 if __name__ == "__main__":
 
   import sys,argparse
+  import corpus
 
   def rollsum(s):
     """Parser for --rollsum argument."""
     try:
-      return dict(rs=RollSum, rk=RabinKarp, cp=CyclicPoly, gr=Gear, rg=RGear, mg=MGear, ug=UGear)[s]
+      return classes[s]
     except KeyError:
       raise ValueError(s)
 
-  def map(s):
-    """Parser for --map argument."""
+  def table(s):
+    """Parser for --table argument."""
     try:
-      return dict(ord=ord, pow=pow, mul=mul, mix=mix, lcg=lcg, ipfs=ipfs)[s]
+      return dict(dict=HashTable, array=ArrayHashTable, sketch=SketchTable)[s]
     except KeyError:
       raise ValueError(s)
 
-  def size(s):
-    """Parser for --blocksize argument."""
-    scales='BKMGT'
-    if s[-1] in scales:
-      return int(s[:-1]) * 1024**(scales.find(s[-1]))
-    else:
-      return int(s)
+  def winid(s):
+    """Parser for --winid argument."""
+    try:
+      return dict(md5=md5ids, poly=polyids)[s]
+    except KeyError:
+      raise ValueError(s)
 
   parser = argparse.ArgumentParser(description='Test different rollsum variants')
   parser.add_argument('--rollsum','-R', type=rollsum, default=RollSum, help='Rollsum to use "rs|rk|cp|gr|rg|mg|ug".')
-  parser.add_argument('--blocksize','-B', type=size, default=1024, help='Block size to use.')
-  parser.add_argument('--blockcount','-C', type=size, default=1000000, help='Number of blocks to use.')
+  parser.add_argument('--blocksize','-B', type=sizearg, default=1024, help='Block size to use.')
+  parser.add_argument('--blockcount','-C', type=sizearg, default=1000000, help='Number of blocks to use.')
   parser.add_argument('--seed', type=int, default=0, help='Value to initialize hash to.')
   parser.add_argument('--offs', type=int, default=31, help='Value to add to each input byte.')
-  parser.add_argument('--base', type=eval, default=2**16, help='RollSum value to mod s1 and s2 with.')
-  parser.add_argument('--mult', type=eval, default=0x08104225, help='RabinKarp multiplier to use.')
-  parser.add_argument('--map', type=map, default=ord, help='Map type to use "ord|pow|mul|mix|lcg|ipfs".')
+  parser.add_argument('--base', type=eval, help='RollSum value to mod s1 and s2 with (default: 2^(width/2)).')
+  parser.add_argument('--mult', type=eval, help='RabinKarp multiplier to use (default: 0x08104225 or 0x5851f42d4c957f2d).')
+  parser.add_argument('--width', type=int, choices=(32, 64), default=32, help='Digest width in bits.')
+  parser.add_argument('--map', type=maparg, default=ord, help='Map type to use "ord|pow|mul|mix|lcg|ipfs" or a map table file.')
+  parser.add_argument('--winid', type=winid, default=md5ids, help='Window identity to use "md5|poly".')
+  parser.add_argument('--table', type=table, default=HashTable, help='Hashtable type to use "dict|array|sketch".')
+  parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of processes to use.')
+  parser.add_argument('--hist', action='store_true', help='Also output hashtable bucket size histograms.')
   parser.add_argument('--indexbits', type=int, default=20, help='Number of bits in the hashtable index.')
+  parser.add_argument('--probe', choices=('linear', 'quadratic'), help='Also test open addressing tables with this probing.')
+  parser.add_argument('--load', type=float, default=0.75, help='Maximum load factor for open addressing tables.')
+  parser.add_argument('--timing', action='store_true', help='Also output the time and calls for each phase of the run.')
+  parser.add_argument('--profile', action='store_true', help='Profile the run and output the hot spots.')
+  parser.add_argument('--corpus', choices=corpus.kinds, help='Synthetic data to use instead of stdin.')
+  parser.add_argument('--corpus-seed', type=int, default=1, help='Random seed for the synthetic data.')
+  parser.add_argument('input', nargs='?', type=argparse.FileType('rb'), help='Data file to mmap instead of reading stdin.')
   args=parser.parse_args()
 
   index_size = 2**args.indexbits
   index_mask = index_size - 1
   # Initialize rollsum and hash tables for collecting stats.
+  width, half = args.width, args.width // 2
   if args.rollsum == RollSum:
-    rollsum = RollSum(seed=args.seed, offs=args.offs, map=args.map, base=args.base)
+    rollsum = RollSum(seed=args.seed, offs=args.offs, map=args.map, base=args.base, width=width)
   elif args.rollsum == RabinKarp:
-    rollsum = RabinKarp(seed=args.seed, offs=args.offs, map=args.map, mult=args.mult)
+    rollsum = RabinKarp(seed=args.seed, offs=args.offs, map=args.map, mult=args.mult, width=width)
   elif args.rollsum == CyclicPoly:
-    rollsum = CyclicPoly(seed=args.seed, offs=args.offs, map=args.map)
+    rollsum = CyclicPoly(seed=args.seed, offs=args.offs, map=args.map, width=width)
   elif args.rollsum in (Gear, RGear, MGear, UGear):
-    rollsum = args.rollsum(offs=args.offs, map=args.map)
-  sumtable = HashTable(2**32, lambda k: k)
-  s1index = HashTable(2**16, lambda k: k & 0xffff)
-  s2index = HashTable(2**16, lambda k: k >> 16)
-  andmask = HashTable(index_size, lambda k: k & index_mask)
-  modmask = HashTable(index_size, lambda k: k % index_mask)
-  mixmask = HashTable(index_size, lambda k: mix32(k) & index_mask)
-  andcluster = HashTable(index_size>>4, lambda k: (k & index_mask)>>4)
-  modcluster = HashTable(index_size>>4, lambda k: (k % index_mask)>>4)
-  mixcluster = HashTable(index_size>>4, lambda k: (mix32(k) & index_mask)>>4)
+    rollsum = args.rollsum(offs=args.offs, map=args.map, width=width)
+  mixn = mix64 if width == 64 else mix32
+  sumtable = args.table(2**width, lambda k: k)
+  s1index = args.table(2**half, lambda k: k & (2**half - 1))
+  s2index = args.table(2**half, lambda k: k >> half)
+  index = indexfuncs(args.indexbits, width)
+  andmask = args.table(index_size, index['and'])
+  modmask = args.table(index_size, index['mod'])
+  mixmask = args.table(index_size, index['mix'])
+  andcluster = args.table(index_size>>4, lambda k: (k & index_mask)>>4)
+  modcluster = args.table(index_size>>4, lambda k: (k % index_mask)>>4)
+  mixcluster = args.table(index_size>>4, lambda k: (mixn(k) & index_mask)>>4)
   titles = ("rollsum:", "s1sum:", "s2sum:", "and_mask:", "mod_mask:", "mix_mask:", "and_clust:", "mod_clust:", "mix_clust:")
   tables = (sumtable, s1index, s2index, andmask, modmask, mixmask, andcluster, modcluster, mixcluster)
+  if args.probe:
+    # Use the smallest power of 2 size with load <= args.load for blockcount.
+    probe_size = 2**int(ceil(log(args.blockcount / args.load, 2)))
+    probe_mask = probe_size - 1
+    titles += ("and_probe:", "mod_probe:", "mix_probe:")
+    tables += (ProbeTable(probe_size, lambda k: k & probe_mask, args.probe),
+               ProbeTable(probe_size, lambda k: k % probe_mask, args.probe),
+               ProbeTable(probe_size, lambda k: mixn(k) & probe_mask, args.probe))
 
   # Run the test and display results.
-  datastats = runtest(rollsum, sys.stdin, args.blocksize, args.blockcount, tables)
+  if args.input:
+    infile = mmap.mmap(args.input.fileno(), 0, access=mmap.ACCESS_READ)
+  elif args.corpus:
+    infile = corpus.Corpus(args.corpus, seed=args.corpus_seed)
+  else:
+    infile = sys.stdin
+  phases = Phases()
+  if args.profile:
+    import cProfile, pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+  if args.jobs > 1:
+    data = infile if args.input else infile.read(args.blockcount + args.blocksize - 1)
+    datastats = runshards(rollsum, data, args.blocksize, args.blockcount,
+                          tables, args.jobs, args.winid, phases)
+  else:
+    datastats = runtest(rollsum, infile, args.blocksize, args.blockcount,
+                        tables, winid=args.winid, phases=phases)
   print "Results for blocksize=%s blockcount=%s %s indexbits=%s" % (
       args.blocksize, args.blockcount, rollsum, args.indexbits)
   print
   print "map_data: %s" % datastats
+  start = time.time()
   for title, table in zip(titles, tables):
-    print title, table
+    t = time.time()
+    stats = table.stats()
+    phases.add('stats', time.time() - t)
+    print title, stats
+    if args.hist:
+      print title[:-1] + '_hist:', stats.histogram()
+  # Include the stats time and memory in the totals.
+  phases.done(time.time() - start, 0)
+  if args.profile:
+    profiler.disable()
+  if args.timing:
+    print
+    print "timing: %s" % phases
+    for line in phases.phases():
+      print "timing_" + line
+  if args.profile:
+    print
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats('tottime').print_stats(25)
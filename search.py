@@ -0,0 +1,173 @@
+#!/usr/bin/pypy -O
+"""Search for good RabinKarp multipliers and rollsum map tables."""
+import md5
+import os
+import random
+from math import exp, log
+from multiprocessing import cpu_count
+import cmphash
+import rollsum
+
+K = 1024
+
+# The hand picked multipliers and map tables to compare candidates against.
+known_mults = (0xfffffffd, 0x55555555, 0x08104225, 0x41c64e6d)
+known_maps = (rollsum.mul, rollsum.mix, rollsum.lcg, rollsum.ipfs)
+
+def bitcount(i):
+  return bin(i).count('1')
+
+def randmult(rnd, width=32):
+  """Get a random odd multiplier with between 3/8 and 5/8 of its bits set."""
+  while True:
+    m = rnd.getrandbits(width) | 1
+    if 3*width <= 8*bitcount(m) <= 5*width:
+      return m
+
+def randtable(rnd, width=32):
+  """Get a random 256 entry map table of distinct width bit values.
+
+  Every bit is set in exactly half of the values, like the buzhash tables.
+  """
+  while True:
+    table = [0] * 256
+    for b in xrange(width):
+      col = [1] * 128 + [0] * 128
+      rnd.shuffle(col)
+      for c, v in enumerate(col):
+        table[c] |= v << b
+    if len(set(table)) == 256:
+      return table
+
+def tablename(table):
+  """Get a name for a map table from the md5sum of its values."""
+  return 'tab' + md5.new(' '.join('%x' % v for v in table)).hexdigest()[:8]
+
+def savemap(table, filename):
+  """Save a map table to a file in the format read by rollsum.loadmap()."""
+  with open(filename, 'w') as f:
+    for i in xrange(0, 256, 6):
+      f.write(' '.join('%#010x' % v for v in table[i:i+6]) + '\n')
+
+def candidates(kind, count, seed=1, cls=rollsum.CyclicPoly, map=ord):
+  """Get a list of (rollsum, table) candidates including the known ones.
+
+  For kind "mult" these are RabinKarp rollsums using map with different
+  multipliers, and for kind "map" they are cls rollsums with different map
+  tables. The table is None for multiplier and known map candidates.
+  """
+  rnd = random.Random(seed)
+  if kind == 'mult':
+    mults = list(known_mults) + [randmult(rnd) for i in xrange(count)]
+    return [(rollsum.RabinKarp(mult=m, map=map), None) for m in mults]
+  ans = [(cls(map=m), None) for m in known_maps]
+  for i in xrange(count):
+    table = randtable(rnd)
+    ans.append((cls(map=rollsum.tablemap(table, tablename(table))), table))
+  return ans
+
+def _runcell(cells, i):
+  """Get the cmphash scores of the rollsums in cell i of cells.
+
+  Each cell is a (start, src, bsize, bcount, sums) tuple.
+  """
+  start, src, bsize, bcount, sums = cells[i]
+  results = cmphash.dotests(src, bcount, [(bsize, sum) for sum in sums])
+  return start, [score for _, _, _, _, _, _, score in results]
+
+def scores(sums, datas, bsizes, bcount, jobs):
+  """Get the score of each rollsum for bcount blocks of every data and bsize.
+
+  The score is the geometric mean of the cmphash.dotest() scores. Each data
+  and bsize is split into at least jobs cells of rollsums that are run in a
+  single pass of the data.
+  """
+  n = -(-len(sums) // max(1, jobs // (len(datas) * len(bsizes))))
+  cells = [(i, src, bsize, bcount, sums[i:i+n])
+           for src in datas for bsize in bsizes
+           for i in xrange(0, len(sums), n)]
+  results = rollsum.forkmap(_runcell, cells, len(cells), jobs)
+  logs = [0.0] * len(sums)
+  for start, cellscores in results:
+    for i, score in enumerate(cellscores, start):
+      logs[i] += log(max(score, 1e-12))
+  ncells = len(datas) * len(bsizes)
+  return [exp(l / ncells) for l in logs]
+
+def halving(sums, datas, bsizes, mincount, maxcount, eta=3, keep=1, jobs=1):
+  """Rank rollsums using successive halving.
+
+  All the rollsums are scored with mincount blocks, then the best 1/eta (but
+  at least keep) are scored again with eta times more blocks, until they are
+  scored with maxcount blocks. Returns a list of (index, bcount, score) for
+  every rollsum, ranked by the last bcount they were scored with and then
+  score.
+  """
+  ranked, survivors, bcount = [], range(len(sums)), mincount
+  while True:
+    results = scores([sums[i] for i in survivors], datas, bsizes, bcount, jobs)
+    results = sorted(zip(survivors, results), key=lambda r: -r[1])
+    print "scored %s with %s blocks: best %.6f" % (len(results), bcount, results[0][1])
+    n = max(keep, len(results) // eta) if bcount < maxcount else 0
+    ranked = [(i, bcount, s) for i, s in results[n:]] + ranked
+    if not n:
+      return ranked
+    survivors, bcount = [i for i, _ in results[:n]], min(maxcount, bcount * eta)
+
+def printtable(results):
+  f = '='
+  hdr = '%4s %8s %8s %-52s %s'
+  fmt = '%4s %8s %8.6f %-52s %s'
+  frame = hdr % (4*f, 8*f, 8*f, 52*f, 24*f)
+  print frame
+  print hdr % ('rank', 'count', 'score', 'rollsum', 'use')
+  print frame
+  for rank, (bcount, score, sum, use) in enumerate(results, 1):
+    print fmt % (rank, bcount, score, sum, use)
+  print frame
+
+
+if __name__ == "__main__":
+
+  import argparse
+
+  parser = argparse.ArgumentParser(description='Search for good RabinKarp multipliers or map tables')
+  parser.add_argument('kind', choices=('mult', 'map'), help='Search for RabinKarp multipliers or map tables.')
+  parser.add_argument('--rollsum', '-R', choices=sorted(rollsum.classes), default='cp', help='Rollsum to search map tables for.')
+  parser.add_argument('--map', choices=sorted(rollsum.maps), default='ord', help='Map to search multipliers with.')
+  parser.add_argument('--candidates', '-n', type=int, default=81, help='Number of random candidates to generate.')
+  parser.add_argument('--seed', type=int, default=1, help='Random seed for generating candidates.')
+  parser.add_argument('--blocksize', '-B', nargs='+', type=rollsum.sizearg, default=[1*K], help='Block sizes to score with.')
+  parser.add_argument('--data', nargs='+', default=['csv', 'zip'], help='Data files or synthetic "synth:<kind>" data to score with.')
+  parser.add_argument('--mincount', type=rollsum.sizearg, default=10000, help='Number of blocks for the first round.')
+  parser.add_argument('--maxcount', type=rollsum.sizearg, default=1000000, help='Maximum number of blocks for the last round.')
+  parser.add_argument('--eta', type=int, default=3, help='Keep the best 1/eta candidates each round.')
+  parser.add_argument('--top', type=int, default=10, help='Number of ranked candidates to output.')
+  parser.add_argument('--save', default='data', help='Directory to save the top random map tables to.')
+  parser.add_argument('--jobs', '-j', type=int, default=cpu_count(), help='Number of processes to use.')
+  args=parser.parse_args()
+
+  cands = candidates(args.kind, args.candidates, args.seed,
+                     rollsum.classes[args.rollsum], rollsum.maps[args.map])
+  sums = [sum for sum, _ in cands]
+  ranked = halving(sums, args.data, args.blocksize, args.mincount,
+                   args.maxcount, args.eta, args.top, args.jobs)
+  ans = []
+  for i, bcount, score in ranked[:args.top]:
+    sum, table = cands[i]
+    # The candidates don't use the rollsum.py --seed and --offs defaults.
+    use = '--seed=%s --offs=%s ' % (sum.seed, sum.offs)
+    if args.kind == 'mult':
+      use += '-R rk --map=%s --mult=%#010x' % (args.map, sum.mult)
+    elif table is not None:
+      # Random tables must be saved for rollsum.py to load them.
+      if not os.path.isdir(args.save):
+        os.makedirs(args.save)
+      filename = os.path.join(args.save, sum.map.__name__ + '.map')
+      savemap(table, filename)
+      use += '-R %s --map=%s' % (args.rollsum, filename)
+    else:
+      use += '-R %s --map=%s' % (args.rollsum, sum.map.__name__)
+    ans.append((bcount, score, sum, use))
+  print
+  printtable(ans)